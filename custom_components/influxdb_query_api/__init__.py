@@ -1,12 +1,13 @@
+from http import HTTPStatus
+
 import homeassistant.helpers.config_validation as cv
 from homeassistant.components import http
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import Event, HomeAssistant
 from homeassistant.helpers.typing import ConfigType
 
-from .influxdb_service import run_flux_query
-
-DOMAIN = "influxdb_query_api"
-INFLUXDB_CONF_DOMAIN = "influxdb"
+from .const import DOMAIN, INFLUXDB_CONF_DOMAIN
+from .influxdb_service import cleanup_connections, get_connection_manager, run_flux_queries, run_flux_query
 
 CONFIG_SCHEMA = cv.empty_config_schema(DOMAIN)
 
@@ -16,7 +17,14 @@ async def async_setup(hass: HomeAssistant, config: ConfigType):
         return False
 
     conf = config[INFLUXDB_CONF_DOMAIN]
-    hass.http.register_view(InfluxDBQueryView(conf))
+    manager = get_connection_manager(hass, conf)
+    hass.http.register_view(InfluxDBQueryView(manager))
+    hass.http.register_view(InfluxDBBatchQueryView(manager))
+
+    async def _async_close_connections(event: Event) -> None:
+        await cleanup_connections(hass)
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_close_connections)
     return True
 
 
@@ -25,12 +33,32 @@ class InfluxDBQueryView(http.HomeAssistantView):
     name = f"api:{DOMAIN}"
     requires_auth = True
 
-    def __init__(self, conf):
-        self.conf = conf
+    def __init__(self, manager):
+        self.manager = manager
 
     async def get(self, request, entity_id):
         start = request.query.get("start", "-1h")
         end = request.query.get("end", "now()")
 
-        data = await run_flux_query(self.conf, entity_id, start, end)
+        data = await run_flux_query(self.manager, entity_id, start, end)
+        return self.json(data)
+
+
+class InfluxDBBatchQueryView(http.HomeAssistantView):
+    url = f"/api/{DOMAIN}/batch"
+    name = f"api:{DOMAIN}:batch"
+    requires_auth = True
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    async def get(self, request):
+        entity_ids = [entity_id for entity_id in request.query.get("entity_ids", "").split(",") if entity_id]
+        if not entity_ids:
+            return self.json_message("entity_ids is required", HTTPStatus.BAD_REQUEST)
+
+        start = request.query.get("start", "-1h")
+        end = request.query.get("end", "now()")
+
+        data = await run_flux_queries(self.manager, entity_ids, start, end)
         return self.json(data)
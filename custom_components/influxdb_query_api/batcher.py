@@ -0,0 +1,102 @@
+"""
+Micro-batching of concurrent Flux queries.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _PendingBatch:
+    """Items collected for one batch key, waiting for the flush timer."""
+
+    __slots__ = ("futures", "timer")
+
+    def __init__(self):
+        self.futures: Dict[str, asyncio.Future] = {}
+        self.timer: asyncio.TimerHandle = None
+
+
+class QueryBatcher:
+    """
+    Collects items submitted under the same key within a short window and
+    executes them together.
+
+    Only used from the event loop, so it does no locking of its own.
+    """
+
+    def __init__(self, execute_batch: Callable[[Hashable, List[str]], Awaitable[Dict[str, Any]]],
+                 max_size: int = 50):
+        """
+        Initialize the batcher.
+
+        Args:
+            execute_batch: Coroutine function called with a batch key and its items,
+                returning a result for every item
+            max_size: Number of items that flushes a batch without waiting for its window
+        """
+        self.max_size = max_size
+        self._execute_batch = execute_batch
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._running: Set[asyncio.Task] = set()
+
+    def submit(self, key: Hashable, item: str, window: float) -> asyncio.Future:
+        """
+        Add an item to the batch for a key.
+
+        Args:
+            key: Items with equal keys are executed together
+            item: Item to execute; submitting an item already pending shares its future
+            window: Seconds to wait for more items after the first one of a batch
+
+        Returns:
+            Future resolving to the result for this item
+        """
+        loop = asyncio.get_running_loop()
+
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _PendingBatch()
+            batch.timer = loop.call_later(window, self._flush, key)
+
+        future = batch.futures.get(item)
+        if future is None:
+            future = batch.futures[item] = loop.create_future()
+
+        if len(batch.futures) >= self.max_size:
+            self._flush(key)
+
+        return future
+
+    def _flush(self, key: Hashable):
+        """Start executing the pending batch for a key."""
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._run(key, batch.futures))
+        # Keep a reference until done, the event loop only holds weak ones
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, futures: Dict[str, asyncio.Future]):
+        """Execute a batch and hand each item its result."""
+        _LOGGER.debug(f"Executing batch of {len(futures)} queries")
+        try:
+            results = await self._execute_batch(key, list(futures))
+            for item, future in futures.items():
+                if not future.done():
+                    future.set_result(results[item])
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,7 @@
+"""Constants for the InfluxDB Query API integration."""
+
+DOMAIN = "influxdb_query_api"
+INFLUXDB_CONF_DOMAIN = "influxdb"
+
+# Key of the connection manager in hass.data[DOMAIN]
+DATA_CONNECTION_MANAGER = "connection_manager"
@@ -3,16 +3,32 @@ InfluxDB connection manager with connection pooling and security features.
 """
 import asyncio
 import logging
+import os
 import threading
+import time
+import weakref
 from contextlib import asynccontextmanager
-from queue import Queue, Empty
-from typing import Dict, Any, List
+from typing import Any, Callable, Dict, List
 
-from influxdb_client import InfluxDBClient
+import aiohttp
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
 from influxdb_client.client.exceptions import InfluxDBError
 
 _LOGGER = logging.getLogger(__name__)
 
+# HTTP statuses that indicate a transient server-side or gateway problem
+_RETRY_STATUS = frozenset({408, 429, 502, 503, 504})
+
+# Transport failures raised by the aiohttp-based client before a response arrives
+_RETRY_EXC_TYPES = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+def _warn_not_cleaned_up():
+    """Called when a manager with open connections is garbage collected."""
+    # Note: This is synchronous, so we can't call async cleanup here
+    # Users should call cleanup() explicitly before shutdown
+    _LOGGER.warning("InfluxDBConnectionManager destroyed without explicit cleanup()")
+
 
 class InfluxDBConnectionManager:
     """
@@ -38,10 +54,16 @@ class InfluxDBConnectionManager:
         self.config = config
         self.pool_size = pool_size
         self.max_retries = max_retries
-        self._connection_pool = Queue(maxsize=pool_size)
+        self._connection_pool: asyncio.Queue = asyncio.Queue(maxsize=pool_size)
         self._active_connections = set()
+        self._broken_connections = set()
+        self._last_used: Dict[InfluxDBClientAsync, float] = {}
+        # Guards connection bookkeeping; never held across an await
         self._lock = threading.Lock()
+        self._init_lock = asyncio.Lock()
         self._initialized = False
+        # Alive while the pool holds connections; detached by cleanup()
+        self._finalizer: weakref.finalize = None
 
         # Extract configuration
         self.host = config.get("host", "localhost")
@@ -54,46 +76,74 @@ class InfluxDBConnectionManager:
         self.timeout = config.get("timeout", 10000)  # milliseconds
         self.enable_ssl = config.get("ssl", False)
         self.verify_ssl = config.get("verify_ssl", True)
+        # Compress query request and response bodies
+        self.enable_gzip = config.get("enable_gzip", True)
+        # Keep-alive connections held by each client's HTTP pool
+        self.connection_pool_maxsize = config.get(
+            "connection_pool_maxsize", max(32, (os.cpu_count() or 1) * 5)
+        )
+        # Pooled connections idle for longer than this (seconds) are pinged before reuse
+        self.idle_threshold = config.get("idle_threshold", 60)
 
-    def _create_client(self) -> InfluxDBClient:
+    async def _create_client(self) -> InfluxDBClientAsync:
         """Create a new InfluxDB client with current configuration."""
         protocol = "https" if self.enable_ssl else "http"
         url = f"{protocol}://{self.host}:{self.port}"
 
-        client = InfluxDBClient(
+        client = InfluxDBClientAsync(
             url=url,
             token=self.token,
             org=self.organization,
             timeout=self.timeout,
-            verify_ssl=self.verify_ssl
+            verify_ssl=self.verify_ssl,
+            enable_gzip=self.enable_gzip,
+            connection_pool_maxsize=self.connection_pool_maxsize
         )
 
+        self._last_used[client] = time.monotonic()
         _LOGGER.debug(f"Created new InfluxDB client: {self.host}:{self.port}")
         return client
 
-    def _initialize_pool(self):
+    async def _create_and_ping(self) -> InfluxDBClientAsync:
+        """Create a new client and test its connection."""
+        client = await self._create_client()
+        try:
+            await client.ping()
+        except Exception:
+            await self._discard_client(client)
+            raise
+        return client
+
+    async def _initialize_pool(self):
         """Initialize the connection pool with client instances."""
         if self._initialized:
             return
 
-        with self._lock:
+        async with self._init_lock:
             if self._initialized:
                 return
 
             _LOGGER.info(f"Initializing InfluxDB connection pool with {self.pool_size} connections")
 
-            for i in range(self.pool_size):
-                try:
-                    client = self._create_client()
-                    # Test connection
-                    client.ping()
-                    self._connection_pool.put(client)
-                    _LOGGER.debug(f"Added connection {i + 1}/{self.pool_size} to pool")
-                except Exception as e:
-                    _LOGGER.error(f"Failed to create connection {i + 1}: {e}")
-                    # Continue trying to create other connections
+            # Create and test all connections concurrently
+            clients = await asyncio.gather(
+                *(self._create_and_ping() for _ in range(self.pool_size)),
+                return_exceptions=True
+            )
+
+            for i, client in enumerate(clients):
+                if isinstance(client, Exception):
+                    _LOGGER.error(f"Failed to create connection {i + 1}: {client}")
+                    # Continue with the connections that did succeed
+                    continue
+
+                self._connection_pool.put_nowait(client)
+                _LOGGER.debug(f"Added connection {i + 1}/{self.pool_size} to pool")
 
             self._initialized = True
+            self._finalizer = weakref.finalize(self, _warn_not_cleaned_up)
+            # Connections are torn down with the process anyway, don't warn at exit
+            self._finalizer.atexit = False
             _LOGGER.info(f"Connection pool initialized with {self._connection_pool.qsize()} active connections")
 
     @asynccontextmanager
@@ -103,56 +153,81 @@ class InfluxDBConnectionManager:
 
         Usage:
             async with manager.get_client() as client:
-                result = client.query_api().query(query)
+                result = await client.query_api().query(query)
         """
-        self._initialize_pool()
+        await self._initialize_pool()
 
         client = None
         try:
-            # Try to get a client from pool (with timeout)
+            # Take an idle client without suspending when one is available; only
+            # set up a timeout when the pool is empty and we have to wait
             try:
-                client = self._connection_pool.get(timeout=5)
-            except Empty:
-                _LOGGER.warning("Connection pool exhausted, creating new client")
-                client = self._create_client()
-
-            # Test if connection is still valid
-            try:
-                client.ping()
-            except Exception as e:
-                _LOGGER.warning(f"Connection ping failed, creating new client: {e}")
-                client = self._create_client()
+                client = self._connection_pool.get_nowait()
+            except asyncio.QueueEmpty:
+                # Try to get a client from pool (with timeout)
+                try:
+                    client = await asyncio.wait_for(self._connection_pool.get(), timeout=5)
+                except asyncio.TimeoutError:
+                    _LOGGER.warning("Connection pool exhausted, creating new client")
+                    client = await self._create_client()
+
+            # Only ping connections that sat idle long enough to have gone stale;
+            # failures on fresh connections are handled by the query retry logic
+            if time.monotonic() - self._last_used.get(client, 0.0) > self.idle_threshold:
+                try:
+                    await client.ping()
+                except Exception as e:
+                    _LOGGER.warning(f"Connection ping failed, creating new client: {e}")
+                    await self._discard_client(client)
+                    client = await self._create_client()
 
             with self._lock:
                 self._active_connections.add(client)
 
             yield client
 
-        except Exception as e:
-            _LOGGER.error(f"Error in get_client context: {e}")
-            # Don't re-raise if connection is being cleaned up
-            if "connection" in str(e).lower():
-                return
-            raise
         finally:
             if client:
                 with self._lock:
                     self._active_connections.discard(client)
+                    broken = client in self._broken_connections
+                    self._broken_connections.discard(client)
+
+                if broken:
+                    # Replace the failed connection so the pool keeps its size
+                    _LOGGER.debug("Replacing failed connection")
+                    await self._discard_client(client)
+                    client = await self._try_create_client()
 
+            if client:
                 # Try to return client to pool
                 try:
                     if not self._connection_pool.full():
-                        self._connection_pool.put(client, timeout=1)
+                        self._last_used[client] = time.monotonic()
+                        self._connection_pool.put_nowait(client)
                     else:
                         # Pool is full, close this connection
-                        client.close()
+                        await self._discard_client(client)
                         _LOGGER.debug("Connection closed (pool full)")
                 except Exception as e:
                     _LOGGER.warning(f"Failed to return client to pool: {e}")
-                    try:
-                        client.close()
-                    except:
-                        pass
+                    await self._discard_client(client)
+
+    async def _try_create_client(self):
+        """Create a new client, returning None instead of raising on failure."""
+        try:
+            return await self._create_client()
+        except Exception as e:
+            _LOGGER.warning(f"Failed to create replacement client: {e}")
+            return None
+
+    async def _discard_client(self, client: InfluxDBClientAsync):
+        """Close a client that will not be returned to the pool."""
+        self._last_used.pop(client, None)
+        try:
+            await client.close()
+        except Exception:
+            pass
 
     async def execute_query(self, query: str, retry_count: int = 0) -> List[Dict[str, Any]]:
         """
@@ -168,59 +243,90 @@ class InfluxDBConnectionManager:
         Raises:
             Exception: If query fails after all retries
         """
+        result = await self._execute(query, self._parse_records, retry_count)
+        _LOGGER.debug(f"Query successful: {len(result)} records returned")
+        return result
+
+    async def execute_grouped_query(self, query: str, column: str) -> Dict[Any, List[Dict[str, Any]]]:
+        """
+        Execute a Flux query with retry logic, grouping data points by a column.
+
+        Args:
+            query: Flux query string; must keep ``column`` in its output
+            column: Column whose value the data points are grouped by
+
+        Returns:
+            Lists of data points keyed by the value of ``column``
+
+        Raises:
+            Exception: If query fails after all retries
+        """
+        result = await self._execute(query, lambda tables: self._group_records(tables, column))
+        _LOGGER.debug(f"Grouped query successful: records returned for {len(result)} {column} values")
+        return result
+
+    @staticmethod
+    def _parse_records(tables) -> List[Dict[str, Any]]:
+        """Convert query result tables to data points."""
+        # Timestamps stay datetime objects; Home Assistant's orjson-based
+        # view serializer writes them as ISO 8601 natively
+        return [
+            {"time": record.get_time(), "value": record.get_value()}
+            for table in tables
+            for record in table.records
+        ]
+
+    @staticmethod
+    def _group_records(tables, column: str) -> Dict[Any, List[Dict[str, Any]]]:
+        """Convert query result tables to data points grouped by a column."""
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for table in tables:
+            for record in table.records:
+                groups.setdefault(record.values.get(column), []).append(
+                    {"time": record.get_time(), "value": record.get_value()}
+                )
+        return groups
+
+    async def _execute(self, query: str, parse: Callable[[Any], Any], retry_count: int = 0) -> Any:
+        """Execute a Flux query, parse its tables and retry transient failures."""
         last_error = None
 
         async with self.get_client() as client:
             try:
                 _LOGGER.debug(f"Executing query (attempt {retry_count + 1}): {query[:100]}...")
 
-                tables = client.query_api().query(query)
-                result = []
-
-                for table in tables:
-                    for record in table.records:
-                        result.append({
-                            "time": record.get_time().isoformat(),
-                            "value": record.get_value()
-                        })
-
-                _LOGGER.debug(f"Query successful: {len(result)} records returned")
-                return result
+                tables = await client.query_api().query(query)
+                return parse(tables)
 
-            except InfluxDBError as e:
+            except (InfluxDBError, *_RETRY_EXC_TYPES) as e:
                 last_error = e
-                _LOGGER.warning(f"InfluxDB query error (attempt {retry_count + 1}): {e}")
+                _LOGGER.warning(f"InfluxDB query error (attempt {retry_count + 1}): {e!r}")
 
                 # Retry on connection-related errors
-                if retry_count < self.max_retries and self._should_retry(e):
-                    _LOGGER.info(f"Retrying query ({retry_count + 1}/{self.max_retries})")
-                    await asyncio.sleep(0.5 * (retry_count + 1))  # Exponential backoff
-                    return await self.execute_query(query, retry_count + 1)
+                if retry_count >= self.max_retries or not self._should_retry(e):
+                    raise Exception(f"InfluxDB query failed after {retry_count + 1} attempts: {e}")
 
-                raise Exception(f"InfluxDB query failed after {retry_count + 1} attempts: {e}")
+                # The connection is suspect, rebuild it instead of returning it to the pool
+                with self._lock:
+                    self._broken_connections.add(client)
 
             except Exception as e:
                 last_error = e
                 _LOGGER.error(f"Unexpected error during query: {e}")
                 raise Exception(f"Query execution failed: {e}")
 
-    def _should_retry(self, error: InfluxDBError) -> bool:
-        """Determine if a query should be retried based on error type."""
-        error_str = str(error).lower()
-
-        # Retry on connection-related errors
-        retryable_errors = [
-            "connection",
-            "timeout",
-            "network",
-            "unavailable",
-            "temporary",
-            "502",
-            "503",
-            "504"
-        ]
+        _LOGGER.info(f"Retrying query ({retry_count + 1}/{self.max_retries})")
+        await asyncio.sleep(0.5 * (retry_count + 1))  # Exponential backoff
+        return await self._execute(query, parse, retry_count + 1)
 
-        return any(err in error_str for err in retryable_errors)
+    def _should_retry(self, error: Exception) -> bool:
+        """Determine if a query should be retried based on error type and HTTP status."""
+        # ApiException carries the status itself, other InfluxDBErrors on their response
+        status = getattr(error, "status", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status", None)
+
+        return status in _RETRY_STATUS or isinstance(error, _RETRY_EXC_TYPES)
 
     def get_pool_status(self) -> Dict[str, Any]:
         """Get current connection pool status."""
@@ -238,31 +344,36 @@ class InfluxDBConnectionManager:
         _LOGGER.info("Cleaning up InfluxDB connection pool")
 
         with self._lock:
-            # Close all connections in pool
+            pooled_clients = []
             while not self._connection_pool.empty():
                 try:
-                    client = self._connection_pool.get_nowait()
-                    client.close()
-                except Empty:
+                    pooled_clients.append(self._connection_pool.get_nowait())
+                except asyncio.QueueEmpty:
                     break
-                except Exception as e:
-                    _LOGGER.warning(f"Error closing pooled connection: {e}")
 
-            # Close active connections
-            for client in list(self._active_connections):
-                try:
-                    client.close()
-                except Exception as e:
-                    _LOGGER.warning(f"Error closing active connection: {e}")
+            active_clients = list(self._active_connections)
 
             self._active_connections.clear()
+            self._broken_connections.clear()
+            self._last_used.clear()
             self._initialized = False
 
-        _LOGGER.info("Connection pool cleanup completed")
+            if self._finalizer:
+                self._finalizer.detach()
+                self._finalizer = None
 
-    def __del__(self):
-        """Destructor to ensure cleanup."""
-        if hasattr(self, '_initialized') and self._initialized:
-            # Note: This is synchronous, so we can't call async cleanup here
-            # Users should call cleanup() explicitly before shutdown
-            _LOGGER.warning("InfluxDBConnectionManager destroyed without explicit cleanup()")
+        # Close all connections in pool
+        for client in pooled_clients:
+            try:
+                await client.close()
+            except Exception as e:
+                _LOGGER.warning(f"Error closing pooled connection: {e}")
+
+        # Close active connections
+        for client in active_clients:
+            try:
+                await client.close()
+            except Exception as e:
+                _LOGGER.warning(f"Error closing active connection: {e}")
+
+        _LOGGER.info("Connection pool cleanup completed")
@@ -3,28 +3,118 @@ InfluxDB query service with security, validation, and connection management.
 """
 import asyncio
 import logging
-from typing import Dict, Any, List
-
+import re
+import weakref
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .batcher import QueryBatcher
+from .cache import QueryResultCache
+from .const import DATA_CONNECTION_MANAGER, DOMAIN
 from .influxdb_client import InfluxDBConnectionManager
 from .utils import SecurityValidator
 
 _LOGGER = logging.getLogger(__name__)
 
-# Global connection manager instance
-_connection_manager: InfluxDBConnectionManager = None
+# RFC 3339 timestamps; ranges bounded by these on both ends do not move with now()
+_ABSOLUTE_TIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T')
+
+
+class _QueryState:
+    """Result cache, in-flight queries and pending batches of one connection manager."""
+
+    __slots__ = ("result_cache", "inflight_queries", "batcher")
+
+    def __init__(self):
+        # Recent query results, keyed by the generated Flux query
+        self.result_cache = QueryResultCache(maxsize=1024)
+        # Queries currently being executed, keyed by the generated Flux query.
+        # Only touched from the event loop, so no locking is needed.
+        self.inflight_queries: Dict[str, asyncio.Future] = {}
+        # Batches concurrent queries for entities of the same domain and time range
+        self.batcher = QueryBatcher(_execute_batch)
+
 
+# Query state per connection manager. The Flux query says nothing about the
+# server it runs against, so managers for different servers must not share
+# results; weak keys let the state go away along with its manager.
+_query_states: "weakref.WeakKeyDictionary[InfluxDBConnectionManager, _QueryState]" = weakref.WeakKeyDictionary()
 
-def get_connection_manager(config: Dict[str, Any]) -> InfluxDBConnectionManager:
-    """Get or create a connection manager instance."""
-    global _connection_manager
 
-    if _connection_manager is None:
+def _get_query_state(manager: InfluxDBConnectionManager) -> _QueryState:
+    """Get or create the query state of a connection manager."""
+    state = _query_states.get(manager)
+    if state is None:
+        state = _query_states[manager] = _QueryState()
+    return state
+
+
+def get_connection_manager(hass, config: Dict[str, Any]) -> InfluxDBConnectionManager:
+    """
+    Get or create the connection manager stored in ``hass.data[DOMAIN]``.
+
+    Keeping it on the hass instance instead of in a module global ties its
+    lifetime to that instance, so separate instances (and tests) do not share
+    pooled connections.
+    """
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    manager = domain_data.get(DATA_CONNECTION_MANAGER)
+
+    if manager is None:
         pool_size = config.get("pool_size", 5)
         max_retries = config.get("max_retries", 3)
-        _connection_manager = InfluxDBConnectionManager(config, pool_size, max_retries)
+        manager = InfluxDBConnectionManager(config, pool_size, max_retries)
+        domain_data[DATA_CONNECTION_MANAGER] = manager
         _LOGGER.info(f"Created InfluxDB connection manager with pool_size={pool_size}")
 
-    return _connection_manager
+    return manager
+
+
+def _get_cache_ttl(conf: Dict[str, Any], range_start: str, range_stop: str) -> float:
+    """
+    Get how long results for a time range may be served from cache.
+
+    Ranges relative to now() move on every call, so they are only cached briefly;
+    ranges with two absolute bounds are stable and can be kept longer.
+    """
+    if _ABSOLUTE_TIME_PATTERN.match(range_start) and _ABSOLUTE_TIME_PATTERN.match(range_stop):
+        return conf.get("cache_ttl_absolute", 60)
+    return conf.get("cache_ttl", 5)
+
+
+@lru_cache(maxsize=2048)
+def _safe_template(bucket: str, domain: str, entity: str) -> str:
+    """
+    Build the Flux query template for an entity, with time range placeholders.
+
+    The template only depends on the entity, so it is built and checked once
+    and reused for every time range requested for it.
+
+    Args:
+        bucket: Validated bucket name
+        domain: Sanitized domain name
+        entity: Sanitized entity name
+
+    Returns:
+        Secure Flux query template with {start} and {stop} placeholders
+    """
+    # Use SecurityValidator to build safe filter
+    safe_filter = SecurityValidator.build_safe_filter(domain, entity)
+
+    # Only _time and _value are returned, so have InfluxDB drop every other
+    # column instead of parsing them for each record on our side
+    template = f'''from(bucket: "{bucket}")
+    |> range(start: {{start}}, stop: {{stop}})
+    |> filter(fn: (r) => {safe_filter})
+    |> keep(columns: ["_time", "_value"])'''
+
+    # Final safety check. Every component was already validated, so this only
+    # guards against mistakes in the query construction and is skipped under -O
+    if __debug__:
+        assert not SecurityValidator.check_for_injection_attempts(template), \
+            "Potentially dangerous query detected after construction"
+
+    return template
 
 
 def _build_safe_query(bucket: str, domain: str, entity: str, range_start: str, range_stop: str) -> str:
@@ -41,26 +131,49 @@ def _build_safe_query(bucket: str, domain: str, entity: str, range_start: str, r
     Returns:
         Secure Flux query string
     """
-    # Use SecurityValidator to build safe filter
-    safe_filter = SecurityValidator.build_safe_filter(domain, entity)
+    return _safe_template(bucket, domain, entity).format(start=range_start, stop=range_stop)
+
+
+def _build_safe_batch_query(bucket: str, domain: str, entities: List[str],
+                            range_start: str, range_stop: str) -> str:
+    """
+    Build a secure Flux query for several entities of one domain.
+
+    The entity_id column is kept so the result can be split per entity.
+
+    Args:
+        bucket: Validated bucket name
+        domain: Sanitized domain name
+        entities: Sanitized entity names
+        range_start: Validated start time expression
+        range_stop: Validated stop time expression
+
+    Returns:
+        Secure Flux query string
+    """
+    safe_filter = SecurityValidator.build_safe_batch_filter(domain, sorted(entities))
 
     query = f'''from(bucket: "{bucket}")
     |> range(start: {range_start}, stop: {range_stop})
-    |> filter(fn: (r) => {safe_filter})'''
+    |> filter(fn: (r) => {safe_filter})
+    |> keep(columns: ["_time", "_value", "entity_id"])'''
 
-    # Final safety check
-    if SecurityValidator.check_for_injection_attempts(query):
-        raise ValueError("Potentially dangerous query detected after construction")
+    # Final safety check. Every component was already validated, so this only
+    # guards against mistakes in the query construction and is skipped under -O
+    if __debug__:
+        assert not SecurityValidator.check_for_injection_attempts(query), \
+            "Potentially dangerous query detected after construction"
 
     return query
 
 
-async def run_flux_query(conf: Dict[str, Any], entity_id: str, range_start: str, range_stop: str) -> List[Dict[str, Any]]:
+async def run_flux_query(manager: InfluxDBConnectionManager, entity_id: str,
+                         range_start: str, range_stop: str) -> List[Dict[str, Any]]:
     """
     Execute a secure Flux query against InfluxDB.
 
     Args:
-        conf: InfluxDB configuration dictionary
+        manager: Connection manager from get_connection_manager
         entity_id: Home Assistant entity ID (format: domain.entity)
         range_start: Start time for query (Flux time expression)
         range_stop: End time for query (Flux time expression)
@@ -72,8 +185,25 @@ async def run_flux_query(conf: Dict[str, Any], entity_id: str, range_start: str,
         ValueError: For invalid input parameters
         Exception: For InfluxDB connection/query errors
     """
+    # Batching across requests is opt-in, as it holds every uncached query
+    # back for the length of the window
+    window = manager.config.get("batch_window", 0)
+    return await _run_flux_query(manager, entity_id, range_start, range_stop, window or None)
+
+
+async def _run_flux_query(manager: InfluxDBConnectionManager, entity_id: str, range_start: str,
+                          range_stop: str, batch_window: Optional[float]) -> List[Dict[str, Any]]:
+    """
+    Execute a secure Flux query against InfluxDB, see run_flux_query.
+
+    Args:
+        batch_window: Seconds to wait for queries to batch this one with;
+            0 only batches queries submitted in the same event loop iteration,
+            None does not batch
+    """
     try:
         _LOGGER.debug(f"Starting query execution for entity: {entity_id}")
+        conf = manager.config
 
         # Validate all inputs using SecurityValidator
         params = {
@@ -92,15 +222,29 @@ async def run_flux_query(conf: Dict[str, Any], entity_id: str, range_start: str,
         validated_start = validated_params['range_start']
         validated_stop = validated_params['range_stop']
 
-        # Get connection manager
-        manager = get_connection_manager(conf)
-
         # Build secure query
         query = _build_safe_query(bucket, domain, entity, validated_start, validated_stop)
         _LOGGER.debug(f"Generated secure query for {entity_id}")
 
+        state = _get_query_state(manager)
+        cached = state.result_cache.get(query)
+        if cached is not None:
+            _LOGGER.debug(f"Serving cached result for {entity_id}: {len(cached)} records")
+            return cached
+
         # Execute query with connection pooling and retry logic
-        result = await manager.execute_query(query)
+        if batch_window is not None:
+            # Entities of one domain requested for the same range within the
+            # window are fetched with a single query
+            batch_key = (manager, bucket, domain, validated_start, validated_stop)
+            result = await _execute_coalesced(
+                state, query, lambda: state.batcher.submit(batch_key, entity, batch_window)
+            )
+        else:
+            ttl = _get_cache_ttl(conf, validated_start, validated_stop)
+            result = await _execute_coalesced(
+                state, query, lambda: asyncio.ensure_future(_execute_and_cache(manager, query, ttl))
+            )
 
         _LOGGER.info(f"Query successful for {entity_id}: {len(result)} records")
         return result
@@ -113,20 +257,110 @@ async def run_flux_query(conf: Dict[str, Any], entity_id: str, range_start: str,
         raise Exception(f"Query execution failed: {str(e)}")
 
 
-async def cleanup_connections():
-    """Cleanup connection manager and all connections."""
-    global _connection_manager
+async def run_flux_queries(manager: InfluxDBConnectionManager, entity_ids: List[str],
+                           range_start: str, range_stop: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Execute secure Flux queries for several entities over the same time range.
 
-    if _connection_manager:
-        await _connection_manager.cleanup()
-        _connection_manager = None
+    Args:
+        manager: Connection manager from get_connection_manager
+        entity_ids: Home Assistant entity IDs (format: domain.entity)
+        range_start: Start time for query (Flux time expression)
+        range_stop: End time for query (Flux time expression)
+
+    Returns:
+        Lists of data points keyed by entity ID
+
+    Raises:
+        ValueError: For invalid input parameters
+        Exception: For InfluxDB connection/query errors
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    # All entities are submitted before the next loop iteration, so they are
+    # batched without waiting for a window unless one is configured
+    window = manager.config.get("batch_window", 0)
+    results = await asyncio.gather(*(
+        _run_flux_query(manager, entity_id, range_start, range_stop, window) for entity_id in entity_ids
+    ))
+    return dict(zip(entity_ids, results))
+
+
+async def _execute_coalesced(state: _QueryState, query: str,
+                             start_query: Callable[[], asyncio.Future]) -> List[Dict[str, Any]]:
+    """
+    Execute a query, sharing the result with identical queries already in flight.
+
+    Concurrent callers asking the same manager for the same query await a single execution
+    instead of each sending it to InfluxDB; ``start_query`` is only called
+    when none is running yet. The result is shared between callers and must
+    not be mutated.
+    """
+    inflight = state.inflight_queries
+    future = inflight.get(query)
+    if future is None:
+        future = start_query()
+        inflight[query] = future
+        future.add_done_callback(lambda _: inflight.pop(query, None))
+    else:
+        _LOGGER.debug("Joining identical query already in flight")
+
+    # Shield so a cancelled caller does not cancel the query for the others
+    return await asyncio.shield(future)
+
+
+async def _execute_and_cache(manager: InfluxDBConnectionManager, query: str, ttl: float) -> List[Dict[str, Any]]:
+    """Execute a query and cache its result for ``ttl`` seconds."""
+    result = await manager.execute_query(query)
+    _get_query_state(manager).result_cache.set(query, result, ttl)
+    return result
+
+
+async def _execute_batch(key: Tuple[InfluxDBConnectionManager, str, str, str, str],
+                         entities: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Execute the queries for a batch of entities sharing a domain and time range.
+
+    Args:
+        key: Connection manager, bucket, domain, start and stop of the batch
+        entities: Sanitized entity names
+
+    Returns:
+        Lists of data points keyed by entity name
+    """
+    manager, bucket, domain, range_start, range_stop = key
+    ttl = _get_cache_ttl(manager.config, range_start, range_stop)
+
+    if len(entities) == 1:
+        query = _build_safe_query(bucket, domain, entities[0], range_start, range_stop)
+        return {entities[0]: await _execute_and_cache(manager, query, ttl)}
+
+    query = _build_safe_batch_query(bucket, domain, entities, range_start, range_stop)
+    grouped = await manager.execute_grouped_query(query, "entity_id")
+
+    result_cache = _get_query_state(manager).result_cache
+    results = {}
+    for entity in entities:
+        results[entity] = grouped.get(entity, [])
+        single_query = _build_safe_query(bucket, domain, entity, range_start, range_stop)
+        result_cache.set(single_query, results[entity], ttl)
+    return results
+
+
+async def cleanup_connections(hass):
+    """Cleanup connection manager and all connections."""
+    manager = hass.data.get(DOMAIN, {}).pop(DATA_CONNECTION_MANAGER, None)
+    if manager:
+        state = _query_states.pop(manager, None)
+        if state:
+            state.result_cache.clear()
+        await manager.cleanup()
         _LOGGER.info("InfluxDB connection manager cleaned up")
 
 
-def get_connection_status() -> Dict[str, Any]:
+def get_connection_status(hass) -> Dict[str, Any]:
     """Get current connection pool status for monitoring."""
-    global _connection_manager
+    manager = hass.data.get(DOMAIN, {}).get(DATA_CONNECTION_MANAGER)
 
-    if _connection_manager:
-        return _connection_manager.get_pool_status()
+    if manager:
+        return manager.get_pool_status()
     return {"status": "Not initialized"}
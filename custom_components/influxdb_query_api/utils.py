@@ -2,6 +2,7 @@
 Security utilities for input validation, sanitization, and escaping.
 """
 import re
+from functools import lru_cache
 from typing import Dict, Any, List, Optional, Tuple
 
 
@@ -14,29 +15,39 @@ class SecurityValidator:
     """
 
     # Regex patterns for validation
-    ENTITY_ID_PATTERN = re.compile(r'^[a-zA-Z0-9_]+\.[a-zA-Z0-9_]+$')
+    ENTITY_ID_PATTERN = re.compile(r'^(?P<domain>[a-zA-Z0-9_]{1,50})\.(?P<entity>[a-zA-Z0-9_]{1,100})$')
     DOMAIN_PATTERN = re.compile(r'^[a-zA-Z0-9_]+$')
     ENTITY_PATTERN = re.compile(r'^[a-zA-Z0-9_]+$')
     BUCKET_PATTERN = re.compile(r'^[a-zA-Z0-9_-]+$')
 
-    # Dangerous patterns that should never appear in user input
-    DANGEROUS_PATTERNS = [
-        r'import\s+\w+',
-        r'from\s*\(',
-        r'buckets?\s*\(',
-        r'drop\s*\(',
-        r'delete\s*\(',
-        r'org\s*\(',
-        r'token\s*\(',
-        r'exec\s*\(',
-        r'eval\s*\(',
-        r'system\s*\(',
-        r'shell\s*\(',
-        r'__system',
-        r'_measurement\s*=\s*["\'][^"\']*["\'].*or',
-        r'_field\s*=\s*["\'][^"\']*["\'].*or',
-        r'entity_id\s*=\s*["\'][^"\']*["\'].*or',
-    ]
+    # Keywords that are rejected in time range parameters
+    TIME_RANGE_DANGEROUS_KEYWORDS = (
+        'import', 'from(', 'buckets(', 'drop(', 'delete(',
+        'org(', 'token(', 'exec(', 'eval(', 'system(',
+        'javascript:', 'data:', 'vbscript:', 'file:', 'ftp:', 'http:', 'https:'
+    )
+
+    # Keywords that mark a constructed query as an injection attempt
+    INJECTION_KEYWORDS = (
+        'import ', 'buckets(', 'drop(', 'delete(',
+        'org(', 'token(', 'exec(', 'eval(', 'system(',
+        'javascript:', 'data:', 'vbscript:', 'file:', 'ftp:',
+        'drop table', 'delete from', 'insert into', 'update set',
+        'union select', 'script>', '<script'
+    )
+
+    # Keyword lists compiled into single case-insensitive alternations. Time ranges are
+    # also checked for injection keywords, as they are substituted into cached query
+    # templates that were only checked once, without a time range.
+    TIME_RANGE_DANGEROUS_PATTERN = re.compile(
+        '|'.join(re.escape(keyword) for keyword in TIME_RANGE_DANGEROUS_KEYWORDS + INJECTION_KEYWORDS),
+        re.IGNORECASE
+    )
+    INJECTION_PATTERN = re.compile(
+        '|'.join(re.escape(keyword) for keyword in INJECTION_KEYWORDS), re.IGNORECASE
+    )
+    FROM_CALL_PATTERN = re.compile(r'from\(', re.IGNORECASE)
+    FROM_BUCKET_PATTERN = re.compile(r'from\(bucket:', re.IGNORECASE)
 
     # Characters that should be removed from identifiers
     DANGEROUS_CHARS = ['"', "'", '`', '\\', ';', '|', '>', '<', '&', '$', '(', ')', '[', ']', '{', '}', '\n', '\r', '\t']
@@ -51,6 +62,10 @@ class SecurityValidator:
         '\t': '\\t',
     }
 
+    # Translation tables applying the above in a single pass
+    SANITIZE_TABLE = str.maketrans('', '', ''.join(DANGEROUS_CHARS))
+    ESCAPE_TABLE = str.maketrans(ESCAPE_CHARS)
+
     @classmethod
     def sanitize_identifier(cls, value: str) -> str:
         """
@@ -72,9 +87,7 @@ class SecurityValidator:
             raise ValueError("Value cannot be empty")
 
         # Remove dangerous characters
-        sanitized = value.strip()
-        for char in cls.DANGEROUS_CHARS:
-            sanitized = sanitized.replace(char, '')
+        sanitized = value.strip().translate(cls.SANITIZE_TABLE)
 
         # Additional validation
         if not sanitized:
@@ -100,11 +113,7 @@ class SecurityValidator:
         if not isinstance(value, str):
             return str(value)
 
-        escaped = value
-        for char, replacement in cls.ESCAPE_CHARS.items():
-            escaped = escaped.replace(char, replacement)
-
-        return escaped
+        return value.translate(cls.ESCAPE_TABLE)
 
     @classmethod
     def validate_entity_id(cls, entity_id: str) -> Tuple[str, str]:
@@ -123,6 +132,13 @@ class SecurityValidator:
         if not entity_id or not isinstance(entity_id, str):
             raise ValueError("Invalid entity_id: must be a non-empty string")
 
+        # Fast path: a single match covers format, characters and length limits
+        match = cls.ENTITY_ID_PATTERN.fullmatch(entity_id)
+        if match:
+            return match['domain'], match['entity']
+
+        # Slow path: run the individual checks to report which one failed
+
         # Basic format check (domain.entity)
         if '.' not in entity_id:
             raise ValueError("Invalid entity_id: must contain '.' separator (format: domain.entity)")
@@ -192,20 +208,11 @@ class SecurityValidator:
         if not isinstance(range_start, str) or not isinstance(range_stop, str):
             raise ValueError("Time range parameters must be strings")
 
-        # Check for dangerous patterns
-        for param in [range_start, range_stop]:
-            param_lower = param.lower()
-
-            # Check for obvious injection attempts
-            dangerous_keywords = [
-                'import', 'from(', 'buckets(', 'drop(', 'delete(',
-                'org(', 'token(', 'exec(', 'eval(', 'system(',
-                'javascript:', 'data:', 'vbscript:', 'file:', 'ftp:', 'http:', 'https:'
-            ]
-
-            for keyword in dangerous_keywords:
-                if keyword in param_lower:
-                    raise ValueError(f"Potentially dangerous pattern detected in time range: {keyword}")
+        # Check for obvious injection attempts
+        for param in (range_start, range_stop):
+            match = cls.TIME_RANGE_DANGEROUS_PATTERN.search(param)
+            if match:
+                raise ValueError(f"Potentially dangerous pattern detected in time range: {match.group(0).lower()}")
 
         return range_start, range_stop
 
@@ -223,23 +230,32 @@ class SecurityValidator:
         Raises:
             ValueError: If any parameter is invalid
         """
-        validated = {}
-
-        # Validate entity_id
-        if 'entity_id' in params:
-            domain, entity = cls.validate_entity_id(params['entity_id'])
-            validated['domain'] = cls.sanitize_identifier(domain)
-            validated['entity'] = cls.sanitize_identifier(entity)
-
-        # Validate bucket
-        if 'bucket' in params:
-            validated['bucket'] = cls.validate_bucket_name(params['bucket'])
-
-        # Validate time range
-        if 'range_start' in params and 'range_stop' in params:
-            start, stop = cls.validate_time_range(params['range_start'], params['range_stop'])
-            validated['range_start'] = start
-            validated['range_stop'] = stop
+        core_values = tuple(params.get(key) for key in ('entity_id', 'bucket', 'range_start', 'range_stop'))
+
+        if all(isinstance(value, str) for value in core_values):
+            # Full parameter set of a query: served from cache for repeatedly polled entities
+            validated = dict(zip(
+                ('domain', 'entity', 'bucket', 'range_start', 'range_stop'),
+                cls._validate_core_parameters(*core_values)
+            ))
+        else:
+            validated = {}
+
+            # Validate entity_id
+            if 'entity_id' in params:
+                domain, entity = cls.validate_entity_id(params['entity_id'])
+                validated['domain'] = cls.sanitize_identifier(domain)
+                validated['entity'] = cls.sanitize_identifier(entity)
+
+            # Validate bucket
+            if 'bucket' in params:
+                validated['bucket'] = cls.validate_bucket_name(params['bucket'])
+
+            # Validate time range
+            if 'range_start' in params and 'range_stop' in params:
+                start, stop = cls.validate_time_range(params['range_start'], params['range_stop'])
+                validated['range_start'] = start
+                validated['range_stop'] = stop
 
         # Copy safe parameters
         for key, value in params.items():
@@ -251,6 +267,31 @@ class SecurityValidator:
 
         return validated
 
+    @classmethod
+    @lru_cache(maxsize=4096)
+    def _validate_core_parameters(cls, entity_id: str, bucket: str, range_start: str,
+                                  range_stop: str) -> Tuple[str, str, str, str, str]:
+        """
+        Validate the parameters every query carries, memoized on their values.
+
+        Only successful validations are cached; invalid input raises every time.
+
+        Returns:
+            Tuple of (domain, entity, bucket, range_start, range_stop)
+        """
+        # Same order of checks as the uncached path, so both report the same error
+        domain, entity = cls.validate_entity_id(entity_id)
+        validated_bucket = cls.validate_bucket_name(bucket)
+        start, stop = cls.validate_time_range(range_start, range_stop)
+
+        return (
+            cls.sanitize_identifier(domain),
+            cls.sanitize_identifier(entity),
+            validated_bucket,
+            start,
+            stop
+        )
+
     @classmethod
     def build_safe_filter(cls, domain: str, entity: str, field: str = "value") -> str:
         """
@@ -268,6 +309,28 @@ class SecurityValidator:
 
         return f'r["_measurement"] == "{domain}" and r["entity_id"] == "{entity}" and r["_field"] == "{safe_field}"'
 
+    @classmethod
+    def build_safe_batch_filter(cls, domain: str, entities: List[str], field: str = "value") -> str:
+        """
+        Build a safe filter expression matching several entities of one domain.
+
+        Entities are matched with an ``or`` of equality predicates rather than
+        ``contains()``, which Flux does not push down to storage and would
+        scan the whole measurement for.
+
+        Args:
+            domain: Sanitized domain name
+            entities: Sanitized entity names
+            field: Field name to filter on
+
+        Returns:
+            Safe filter expression
+        """
+        safe_field = cls.sanitize_identifier(field)
+        entity_match = " or ".join(f'r["entity_id"] == "{entity}"' for entity in entities)
+
+        return f'r["_measurement"] == "{domain}" and ({entity_match}) and r["_field"] == "{safe_field}"'
+
     @classmethod
     def check_for_injection_attempts(cls, query: str) -> bool:
         """
@@ -279,23 +342,9 @@ class SecurityValidator:
         Returns:
             True if injection attempt detected, False otherwise
         """
-        query_lower = query.lower()
-
         # Check for suspicious keywords
-        suspicious_keywords = [
-            'import ', 'buckets(', 'drop(', 'delete(',
-            'org(', 'token(', 'exec(', 'eval(', 'system(',
-            'javascript:', 'data:', 'vbscript:', 'file:', 'ftp:',
-            'drop table', 'delete from', 'insert into', 'update set',
-            'union select', 'script>', '<script'
-        ]
+        if cls.INJECTION_PATTERN.search(query):
+            return True
 
         # Special case: from( is dangerous only when not part of from(bucket:...)
-        if 'from(' in query_lower and 'from(bucket:' not in query_lower:
-            suspicious_keywords.append('from(')
-
-        for keyword in suspicious_keywords:
-            if keyword in query_lower:
-                return True
-
-        return False
\ No newline at end of file
+        return bool(cls.FROM_CALL_PATTERN.search(query)) and not cls.FROM_BUCKET_PATTERN.search(query)
\ No newline at end of file
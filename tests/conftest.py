@@ -0,0 +1,49 @@
+"""
+Shared fixtures and helpers for the InfluxDB Query API tests.
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from custom_components.influxdb_query_api import influxdb_service as svc
+
+
+# Timestamp of records in tests that do not care about it
+FIXED_TIME = "2025-01-10T12:00:00Z"
+
+
+class FakeRecord:
+    """Lightweight stand-in for a FluxRecord."""
+
+    __slots__ = ("_time", "_value", "values")
+
+    def __init__(self, value, time=FIXED_TIME, values=None):
+        self._time = time
+        self._value = value
+        self.values = values or {}
+
+    def get_time(self):
+        return self._time
+
+    def get_value(self):
+        return self._value
+
+
+@pytest.fixture(autouse=True)
+def clear_query_templates():
+    """Start every test with an empty query template cache."""
+    svc._safe_template.cache_clear()
+    yield
+    svc._safe_template.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def make_query_api():
+    """Factory for query API mocks returning a single table with the given records."""
+    def factory(records):
+        mock_query_api = AsyncMock()
+        mock_query_api.query.return_value = [SimpleNamespace(records=list(records))]
+        return mock_query_api
+
+    return factory
@@ -0,0 +1,84 @@
+"""
+Tests for QueryBatcher class.
+"""
+import asyncio
+
+import pytest
+
+from custom_components.influxdb_query_api.batcher import QueryBatcher
+
+
+class TestQueryBatcher:
+    """Test cases for QueryBatcher."""
+
+    @pytest.fixture
+    def calls(self):
+        """Batches passed to the execute function."""
+        return []
+
+    @pytest.fixture
+    def batcher(self, calls):
+        """Batcher whose results echo the submitted items."""
+        async def execute_batch(key, items):
+            calls.append((key, sorted(items)))
+            return {item: f"{key}:{item}" for item in items}
+
+        return QueryBatcher(execute_batch, max_size=3)
+
+    @pytest.mark.asyncio
+    async def test_items_with_same_key_are_batched(self, batcher, calls):
+        """Test items submitted within the window are executed together."""
+        results = await asyncio.gather(
+            batcher.submit("range", "a", window=0.01),
+            batcher.submit("range", "b", window=0.01),
+        )
+
+        assert results == ["range:a", "range:b"]
+        assert calls == [("range", ["a", "b"])]
+        assert len(batcher) == 0
+
+    @pytest.mark.asyncio
+    async def test_different_keys_are_separate_batches(self, batcher, calls):
+        """Test items with different keys are not batched together."""
+        await asyncio.gather(
+            batcher.submit("first", "a", window=0.01),
+            batcher.submit("second", "a", window=0.01),
+        )
+
+        assert sorted(calls) == [("first", ["a"]), ("second", ["a"])]
+
+    @pytest.mark.asyncio
+    async def test_duplicate_items_share_a_future(self, batcher, calls):
+        """Test an item already pending is only executed once."""
+        first = batcher.submit("range", "a", window=0.01)
+        second = batcher.submit("range", "a", window=0.01)
+
+        assert first is second
+        assert await first == "range:a"
+        assert calls == [("range", ["a"])]
+
+    @pytest.mark.asyncio
+    async def test_full_batch_flushes_immediately(self, batcher, calls):
+        """Test reaching max_size executes the batch without waiting for the window."""
+        futures = [batcher.submit("range", item, window=60) for item in ("a", "b", "c")]
+
+        results = await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+
+        assert results == ["range:a", "range:b", "range:c"]
+        assert len(batcher) == 0
+
+    @pytest.mark.asyncio
+    async def test_error_is_set_on_every_item(self):
+        """Test a failed batch is reported to every item in it."""
+        async def execute_batch(key, items):
+            raise RuntimeError("query failed")
+
+        batcher = QueryBatcher(execute_batch)
+
+        results = await asyncio.gather(
+            batcher.submit("range", "a", window=0.01),
+            batcher.submit("range", "b", window=0.01),
+            return_exceptions=True
+        )
+
+        assert all(isinstance(r, RuntimeError) for r in results)
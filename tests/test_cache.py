@@ -0,0 +1,63 @@
+"""
+Tests for QueryResultCache class.
+"""
+from unittest.mock import patch
+
+from custom_components.influxdb_query_api.cache import QueryResultCache
+
+
+class TestQueryResultCache:
+    """Test cases for QueryResultCache."""
+
+    def test_get_missing_key(self):
+        """Test missing keys return None."""
+        cache = QueryResultCache()
+
+        assert cache.get("query") is None
+
+    def test_set_and_get(self):
+        """Test stored values are returned before they expire."""
+        cache = QueryResultCache()
+        cache.set("query", [{"value": 1}], ttl=5)
+
+        assert cache.get("query") == [{"value": 1}]
+        assert len(cache) == 1
+
+    def test_entry_expires(self):
+        """Test entries are dropped once their TTL has passed."""
+        cache = QueryResultCache()
+
+        with patch('custom_components.influxdb_query_api.cache.time.monotonic', return_value=100.0):
+            cache.set("query", [], ttl=5)
+
+        with patch('custom_components.influxdb_query_api.cache.time.monotonic', return_value=105.0):
+            assert cache.get("query") is None
+
+        assert len(cache) == 0
+
+    def test_non_positive_ttl_not_cached(self):
+        """Test a TTL of zero disables caching."""
+        cache = QueryResultCache()
+        cache.set("query", [], ttl=0)
+
+        assert cache.get("query") is None
+
+    def test_evicts_least_recently_used(self):
+        """Test the cache stays within maxsize by evicting the oldest entry."""
+        cache = QueryResultCache(maxsize=2)
+        cache.set("a", 1, ttl=5)
+        cache.set("b", 2, ttl=5)
+        cache.get("a")  # "b" is now least recently used
+        cache.set("c", 3, ttl=5)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_clear(self):
+        """Test clearing removes all entries."""
+        cache = QueryResultCache()
+        cache.set("query", [], ttl=5)
+        cache.clear()
+
+        assert len(cache) == 0
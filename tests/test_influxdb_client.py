@@ -2,19 +2,25 @@
 Tests for InfluxDBConnectionManager class.
 """
 import asyncio
+import gc
+from concurrent.futures import ThreadPoolExecutor
 import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
-from queue import Empty
-import threading
 
+from homeassistant.helpers.json import json_bytes
 from custom_components.influxdb_query_api.influxdb_client import InfluxDBConnectionManager
+import aiohttp
 from influxdb_client.client.exceptions import InfluxDBError
+from influxdb_client.rest import ApiException
+from .conftest import FIXED_TIME, FakeRecord
 
 
 class TestInfluxDBConnectionManager:
     """Test cases for InfluxDBConnectionManager."""
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def config(self):
         """Test configuration."""
         return {
@@ -28,11 +34,25 @@ class TestInfluxDBConnectionManager:
             "verify_ssl": True
         }
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def manager(self, config):
-        """Create connection manager instance."""
+        """Create connection manager instance, shared by the tests in this module."""
         return InfluxDBConnectionManager(config, pool_size=3, max_retries=2)
 
+    @pytest.fixture(autouse=True)
+    def reset_manager(self, manager):
+        """Return the shared manager to its freshly constructed state."""
+        manager._connection_pool = asyncio.Queue(maxsize=manager.pool_size)
+        manager._active_connections.clear()
+        manager._broken_connections.clear()
+        manager._last_used.clear()
+        # asyncio primitives bind to the loop they are first used on, and each test has its own
+        manager._init_lock = asyncio.Lock()
+        manager._initialized = False
+        if manager._finalizer:
+            manager._finalizer.detach()
+            manager._finalizer = None
+
     def test_manager_initialization(self, config):
         """Test manager initialization."""
         manager = InfluxDBConnectionManager(config, pool_size=5, max_retries=3)
@@ -47,45 +67,54 @@ class TestInfluxDBConnectionManager:
         assert manager.timeout == 5000
         assert manager.enable_ssl is False
         assert manager.verify_ssl is True
+        assert manager.enable_gzip is True
+        assert manager.connection_pool_maxsize >= 32
         assert not manager._initialized
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    def test_create_client(self, mock_client_class, manager):
+    def test_manager_connection_pool_maxsize_override(self, config):
+        """Test HTTP connection pool size can be configured."""
+        manager = InfluxDBConnectionManager({**config, "connection_pool_maxsize": 8})
+
+        assert manager.connection_pool_maxsize == 8
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_create_client(self, mock_client_class, manager):
         """Test client creation."""
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client_class.return_value = mock_client
 
-        client = manager._create_client()
+        client = await manager._create_client()
 
         mock_client_class.assert_called_once_with(
             url="http://localhost:8086",
             token="test-token",
             org="test-org",
             timeout=5000,
-            verify_ssl=True
+            verify_ssl=True,
+            enable_gzip=True,
+            connection_pool_maxsize=manager.connection_pool_maxsize
         )
         assert client == mock_client
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    def test_initialize_pool_success(self, mock_client_class, manager):
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_initialize_pool_success(self, mock_client_class, manager):
         """Test successful pool initialization."""
-        mock_clients = []
-        for i in range(3):
-            mock_client = Mock()
-            mock_client.ping.return_value = True
-            mock_clients.append(mock_client)
-            mock_client_class.side_effect = mock_clients
+        mock_clients = [AsyncMock(**{"ping.return_value": True}) for _ in range(3)]
+        mock_client_class.side_effect = mock_clients
 
-        manager._initialize_pool()
+        await manager._initialize_pool()
 
         assert manager._initialized
         assert manager._connection_pool.qsize() == 3
         assert mock_client_class.call_count == 3
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    def test_initialize_pool_with_failures(self, mock_client_class, manager):
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_initialize_pool_with_failures(self, mock_client_class, manager):
         """Test pool initialization with some failures."""
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.ping.return_value = True
         mock_client_class.side_effect = [
             Exception("Connection failed"),  # First fails
@@ -93,21 +122,49 @@ class TestInfluxDBConnectionManager:
             Exception("Connection failed"),  # Third fails
         ]
 
-        manager._initialize_pool()
+        await manager._initialize_pool()
 
         assert manager._initialized
         # Should have 1 successful connection
         assert manager._connection_pool.qsize() == 1
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_initialize_pool_pings_concurrently(self, mock_client_class, manager):
+        """Test pool warm-up pings all connections at the same time."""
+        # Only released once all three pings are waiting on it
+        barrier = asyncio.Barrier(3)
+        mock_client = AsyncMock()
+        mock_client.ping.side_effect = barrier.wait
+        mock_client_class.return_value = mock_client
+
+        await asyncio.wait_for(manager._initialize_pool(), timeout=1)
+
+        assert manager._connection_pool.qsize() == 3
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_initialize_pool_closes_failed_connections(self, mock_client_class, manager):
+        """Test connections that fail their ping are closed, not pooled."""
+        healthy_client = AsyncMock()
+        failing_client = AsyncMock()
+        failing_client.ping.side_effect = Exception("Ping failed")
+        mock_client_class.side_effect = [healthy_client, failing_client, healthy_client]
+
+        await manager._initialize_pool()
+
+        assert manager._connection_pool.qsize() == 2
+        failing_client.close.assert_awaited_once()
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
     async def test_get_client_from_pool(self, mock_client_class, manager):
         """Test getting client from pool."""
         # Initialize pool
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.ping.return_value = True
         mock_client_class.return_value = mock_client
-        manager._initialize_pool()
+        await manager._initialize_pool()
 
         # Get client
         async with manager.get_client() as client:
@@ -119,11 +176,24 @@ class TestInfluxDBConnectionManager:
         assert client not in manager._active_connections
         assert manager._connection_pool.qsize() == 3  # All 3 original connections should be back
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_get_client_idle_client_skips_timeout(self, mock_client_class, manager):
+        """Test an idle pooled client is handed out without setting up a wait timeout."""
+        mock_client_class.return_value = AsyncMock()
+        await manager._initialize_pool()
+
+        with patch('custom_components.influxdb_query_api.influxdb_client.asyncio.wait_for') as mock_wait_for:
+            async with manager.get_client() as client:
+                assert client == mock_client_class.return_value
+
+        mock_wait_for.assert_not_called()
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
     async def test_get_client_pool_exhausted(self, mock_client_class, manager):
         """Test getting client when pool is exhausted."""
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.ping.return_value = True
         mock_client_class.return_value = mock_client
 
@@ -131,92 +201,197 @@ class TestInfluxDBConnectionManager:
         async with manager.get_client() as client:
             assert client == mock_client
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_get_client_waits_for_returned_client(self, mock_client_class, config):
+        """Test waiting for a pooled client does not block the event loop."""
+        mock_client_class.return_value = AsyncMock()
+        manager = InfluxDBConnectionManager(config, pool_size=1)
+        released = asyncio.Event()
+
+        async def hold_client():
+            async with manager.get_client() as client:
+                await released.wait()
+                return client
+
+        holder = asyncio.ensure_future(hold_client())
+        await asyncio.sleep(0)
+
+        async def wait_for_client():
+            async with manager.get_client() as client:
+                return client
+
+        waiter = asyncio.ensure_future(wait_for_client())
+        await asyncio.sleep(0)
+        released.set()
+
+        assert await waiter is await holder
+        assert mock_client_class.call_count == 1
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_get_client_does_not_ping_fresh_connection(self, mock_client_class, manager):
+        """Test recently used clients are handed out without a ping round-trip."""
+        mock_client = AsyncMock()
+        mock_client.ping.return_value = True
+        mock_client_class.return_value = mock_client
+        await manager._initialize_pool()
+        mock_client.ping.reset_mock()
+
+        async with manager.get_client() as client:
+            assert client == mock_client
+
+        mock_client.ping.assert_not_called()
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
     async def test_get_client_with_ping_failure(self, mock_client_class, manager):
-        """Test client creation when ping fails."""
-        # First client fails ping, second succeeds
-        old_client = Mock()
-        old_client.ping.side_effect = Exception("Ping failed")
+        """Test client creation when ping of an idle connection fails."""
+        old_client = AsyncMock()
+        old_client.ping.return_value = True
 
-        new_client = Mock()
+        new_client = AsyncMock()
         new_client.ping.return_value = True
 
         mock_client_class.side_effect = [old_client, new_client]
 
-        # Initialize pool with failing client
-        manager._initialize_pool()
-        manager._connection_pool.get_nowait()  # Get the failing client
+        # Pool holds a single connection that has been idle past the threshold
+        manager._connection_pool.put_nowait(await manager._create_client())
+        manager._last_used[old_client] -= manager.idle_threshold + 1
+        manager._initialized = True
+        old_client.ping.side_effect = Exception("Ping failed")
 
         # Get client should create new one
         async with manager.get_client() as client:
             assert client == new_client
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+        old_client.close.assert_called_once()
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_get_client_propagates_errors(self, mock_client_class, manager):
+        """Test errors raised while holding a client are not swallowed."""
+        mock_client_class.return_value = AsyncMock()
+
+        with pytest.raises(RuntimeError, match="connection"):
+            async with manager.get_client():
+                raise RuntimeError("connection to the moon lost")
+
+        assert manager._connection_pool.qsize() == manager.pool_size
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
-    async def test_execute_query_success(self, mock_client_class, manager):
+    async def test_execute_query_success(self, mock_client_class, manager, make_query_api):
         """Test successful query execution."""
         # Mock client and query result
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.ping.return_value = True
         mock_client_class.return_value = mock_client
 
-        mock_record = Mock()
-        mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-        mock_record.get_value.return_value = 25.5
-
-        mock_table = Mock()
-        mock_table.records = [mock_record]
-
-        mock_query_api = Mock()
-        mock_query_api.query.return_value = [mock_table]
-        mock_client.query_api.return_value = mock_query_api
+        timestamp = datetime(2025, 1, 10, 12, 0, tzinfo=timezone.utc)
+        mock_client.query_api = Mock(return_value=make_query_api([FakeRecord(25.5, timestamp)]))
 
         result = await manager.execute_query("test query")
 
         assert len(result) == 1
-        assert result[0]["time"] == "2025-01-10T12:00:00Z"
+        assert result[0]["time"] == timestamp
         assert result[0]["value"] == 25.5
+        # Serialized as ISO 8601 by the view's JSON encoder
+        assert json_bytes(result) == b'[{"time":"2025-01-10T12:00:00+00:00","value":25.5}]'
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
-    async def test_execute_query_with_retry(self, mock_client_class, manager):
+    async def test_execute_grouped_query(self, mock_client_class, manager, make_query_api):
+        """Test data points are grouped by the requested column."""
+        mock_client = AsyncMock()
+        mock_client_class.return_value = mock_client
+
+        records = [
+            FakeRecord(value, values={"entity_id": entity})
+            for entity, value in (("temperature", 21.5), ("humidity", 40.0), ("temperature", 22.0))
+        ]
+        mock_client.query_api = Mock(return_value=make_query_api(records))
+
+        result = await manager.execute_grouped_query("test query", "entity_id")
+
+        assert [point["value"] for point in result["temperature"]] == [21.5, 22.0]
+        assert [point["value"] for point in result["humidity"]] == [40.0]
+
+    def test_parse_records_passes_values_through(self):
+        """Test record values of every type are returned unchanged and in order."""
+        values = [25.5, "on", True, False, None, 42, "off", 0, "unknown"]
+        tables = [
+            SimpleNamespace(records=[FakeRecord(value) for value in values[:4]]),
+            SimpleNamespace(records=[FakeRecord(value) for value in values[4:]]),
+        ]
+
+        result = InfluxDBConnectionManager._parse_records(tables)
+
+        assert result == [{"time": FIXED_TIME, "value": value} for value in values]
+
+    def test_parse_records_large_dataset(self):
+        """Test parsing a large result keeps every data point."""
+        records = [FakeRecord(20.0 + (i % 10), i) for i in range(10000)]
+
+        result = InfluxDBConnectionManager._parse_records([SimpleNamespace(records=records)])
+
+        assert len(result) == 10000
+        assert result[-1] == {"time": 9999, "value": 29.0}
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_execute_query_with_retry(self, mock_client_class, manager, make_query_api):
         """Test query execution with retry on connection errors."""
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.ping.return_value = True
         mock_client_class.return_value = mock_client
 
         # First attempt fails with connection error, second succeeds
-        mock_record = Mock()
-        mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-        mock_record.get_value.return_value = 25.5
-
-        mock_table = Mock()
-        mock_table.records = [mock_record]
-
-        mock_query_api = Mock()
+        mock_query_api = make_query_api([FakeRecord(25.5)])
         mock_query_api.query.side_effect = [
-            InfluxDBError("Connection timeout"),
-            [mock_table]
+            ApiException(status=503, reason="Service Unavailable"),
+            mock_query_api.query.return_value
         ]
-        mock_client.query_api.return_value = mock_query_api
+        mock_client.query_api = Mock(return_value=mock_query_api)
 
         result = await manager.execute_query("test query")
 
         assert len(result) == 1
         assert mock_query_api.query.call_count == 2  # Should retry once
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_execute_query_retry_replaces_connection(self, mock_client_class, manager):
+        """Test a connection that failed a query is closed and replaced."""
+        failing_client = AsyncMock()
+        failing_client.query_api = Mock(return_value=AsyncMock())
+        failing_client.query_api.return_value.query.side_effect = aiohttp.ServerDisconnectedError()
+
+        healthy_client = AsyncMock()
+        healthy_client.query_api = Mock(return_value=AsyncMock())
+        healthy_client.query_api.return_value.query.return_value = []
+
+        mock_client_class.side_effect = [failing_client, healthy_client]
+        manager._connection_pool.put_nowait(await manager._create_client())
+        manager._initialized = True
+
+        result = await manager.execute_query("test query")
+
+        assert result == []
+        failing_client.close.assert_called_once()
+        assert manager._connection_pool.get_nowait() == healthy_client
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
     async def test_execute_query_max_retries_exceeded(self, mock_client_class, manager):
         """Test query execution when max retries exceeded."""
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.ping.return_value = True
         mock_client_class.return_value = mock_client
 
-        mock_query_api = Mock()
-        mock_query_api.query.side_effect = InfluxDBError("Persistent connection error")
-        mock_client.query_api.return_value = mock_query_api
+        mock_query_api = AsyncMock()
+        mock_query_api.query.side_effect = aiohttp.ClientConnectionError("Persistent connection error")
+        mock_client.query_api = Mock(return_value=mock_query_api)
 
         with pytest.raises(Exception, match="InfluxDB query failed after"):
             await manager.execute_query("test query")
@@ -224,29 +399,30 @@ class TestInfluxDBConnectionManager:
         # Should attempt initial + max_retries
         assert mock_query_api.query.call_count == 3  # 1 initial + 2 retries
 
-    def test_should_retry_connection_errors(self, manager):
+    @pytest.mark.parametrize("error", [
+        pytest.param(asyncio.TimeoutError(), id="timeout"),
+        pytest.param(aiohttp.ClientConnectionError("network unreachable"), id="connection-error"),
+        pytest.param(aiohttp.ServerDisconnectedError(), id="server-disconnected"),
+        pytest.param(ApiException(status=429, reason="Too Many Requests"), id="429"),
+        pytest.param(ApiException(status=502, reason="Bad Gateway"), id="502"),
+        pytest.param(ApiException(status=503, reason="Service Unavailable"), id="503"),
+        pytest.param(InfluxDBError(response=Mock(status=504, data=b"", headers={}, reason="Gateway Timeout")),
+                     id="504-response"),
+    ])
+    def test_should_retry_connection_errors(self, manager, error):
         """Test retry logic for connection errors."""
-        retryable_errors = [
-            InfluxDBError("connection timeout"),
-            InfluxDBError("network unreachable"),
-            InfluxDBError("temporary failure"),
-            InfluxDBError("502 Bad Gateway"),
-            InfluxDBError("503 Service Unavailable"),
-        ]
-
-        for error in retryable_errors:
-            assert manager._should_retry(error), f"Should retry for: {error}"
-
-    def test_should_not_retry_other_errors(self, manager):
+        assert manager._should_retry(error)
+
+    @pytest.mark.parametrize("error", [
+        pytest.param(ApiException(status=400, reason="invalid query syntax"), id="400"),
+        pytest.param(ApiException(status=401, reason="authentication failed"), id="401"),
+        pytest.param(ApiException(status=404, reason="bucket not found"), id="404"),
+        # Status-less errors are not retried, whatever their message says
+        pytest.param(InfluxDBError(message="connection refused by flux function"), id="no-status"),
+    ])
+    def test_should_not_retry_other_errors(self, manager, error):
         """Test retry logic for non-retryable errors."""
-        non_retryable_errors = [
-            InfluxDBError("invalid query syntax"),
-            InfluxDBError("authentication failed"),
-            InfluxDBError("bucket not found"),
-        ]
-
-        for error in non_retryable_errors:
-            assert not manager._should_retry(error), f"Should not retry for: {error}"
+        assert not manager._should_retry(error)
 
     def test_get_pool_status(self, manager):
         """Test pool status reporting."""
@@ -258,19 +434,15 @@ class TestInfluxDBConnectionManager:
         assert status["initialized"] is False
         assert status["host"] == "localhost:8086"
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
     @pytest.mark.asyncio
     async def test_cleanup(self, mock_client_class, manager):
         """Test connection cleanup."""
-        mock_clients = []
-        for i in range(3):
-            mock_client = Mock()
-            mock_client.ping.return_value = True
-            mock_clients.append(mock_client)
-            mock_client_class.return_value = mock_client
+        mock_clients = [AsyncMock(**{"ping.return_value": True}) for _ in range(3)]
+        mock_client_class.side_effect = mock_clients
 
         # Initialize pool
-        manager._initialize_pool()
+        await manager._initialize_pool()
 
         # Add some active connections
         manager._active_connections.add(mock_clients[0])
@@ -285,6 +457,33 @@ class TestInfluxDBConnectionManager:
         assert len(manager._active_connections) == 0
         assert not manager._initialized
 
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_warns_when_collected_without_cleanup(self, mock_client_class, config, caplog):
+        """Test a manager dropped with open connections logs a warning."""
+        mock_client_class.return_value = AsyncMock()
+        manager = InfluxDBConnectionManager(config)
+        await manager._initialize_pool()
+
+        del manager
+        gc.collect()
+
+        assert "destroyed without explicit cleanup()" in caplog.text
+
+    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync')
+    @pytest.mark.asyncio
+    async def test_no_warning_after_cleanup(self, mock_client_class, config, caplog):
+        """Test a manager that was cleaned up is collected silently."""
+        mock_client_class.return_value = AsyncMock()
+        manager = InfluxDBConnectionManager(config)
+        await manager._initialize_pool()
+        await manager.cleanup()
+
+        del manager
+        gc.collect()
+
+        assert "destroyed without explicit cleanup()" not in caplog.text
+
     def test_thread_safety(self, manager):
         """Test thread safety of connection manager."""
         results = []
@@ -301,19 +500,12 @@ class TestInfluxDBConnectionManager:
             except Exception as e:
                 errors.append(str(e))
 
-        # Create multiple threads
-        threads = []
-        for _ in range(10):
-            thread = threading.Thread(target=worker)
-            threads.append(thread)
-
-        # Start all threads
-        for thread in threads:
-            thread.start()
-
-        # Wait for completion
-        for thread in threads:
-            thread.join()
+        # Run the workers on a pool; it is shut down before the test ends so no
+        # threads outlive it
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = [executor.submit(worker) for _ in range(10)]
+            for future in futures:
+                future.result()
 
         # Check results
         assert len(results) == 10
@@ -5,13 +5,46 @@ import pytest
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 import asyncio
 
+from custom_components.influxdb_query_api import influxdb_service as svc
+from custom_components.influxdb_query_api.const import DATA_CONNECTION_MANAGER, DOMAIN
 from custom_components.influxdb_query_api.influxdb_service import (
-    run_flux_query, get_connection_manager, cleanup_connections,
-    get_connection_status, _build_safe_query
+    run_flux_query, run_flux_queries, get_connection_manager, cleanup_connections,
+    get_connection_status, _build_safe_query, _safe_template, _get_cache_ttl
 )
 from custom_components.influxdb_query_api.utils import SecurityValidator
 
 
+# Query generated by _build_safe_query(bucket, domain, entity, start, stop)
+EXPECTED_QUERY_TEMPLATE = '''from(bucket: "{bucket}")
+    |> range(start: {start}, stop: {stop})
+    |> filter(fn: (r) => r["_measurement"] == "{domain}" and r["entity_id"] == "{entity}" and r["_field"] == "value")
+    |> keep(columns: ["_time", "_value"])'''
+
+
+class _FakeManager:
+    """Hand-written stand-in for InfluxDBConnectionManager that records its queries."""
+
+    def __init__(self, config, result):
+        self.config = config
+        self.result = result
+        self.grouped_result = {}
+        self.error = None
+        self.calls = []
+        self.grouped_calls = []
+
+    async def execute_query(self, query):
+        self.calls.append(query)
+        if self.error:
+            raise self.error
+        return self.result
+
+    async def execute_grouped_query(self, query, column):
+        self.grouped_calls.append((query, column))
+        if self.error:
+            raise self.error
+        return self.grouped_result
+
+
 class TestInfluxDBService:
     """Test cases for InfluxDB query service."""
 
@@ -27,64 +60,62 @@ class TestInfluxDBService:
         }
 
     @pytest.fixture
-    def mock_manager(self):
-        """Mock connection manager."""
-        manager = Mock()
-        manager.execute_query = AsyncMock(return_value=[
+    def hass(self):
+        """Minimal Home Assistant instance with its own hass.data."""
+        hass = Mock()
+        hass.data = {}
+        return hass
+
+    @pytest.fixture
+    def mock_manager(self, config):
+        """Fake connection manager."""
+        return _FakeManager(config, [
             {"time": "2025-01-10T12:00:00Z", "value": 25.5},
             {"time": "2025-01-10T12:05:00Z", "value": 26.0}
         ])
-        return manager
 
-    def test_get_connection_manager_creates_instance(self, config):
+    def test_get_connection_manager_creates_instance(self, hass, config):
         """Test connection manager creation."""
-        # Clear global variable
-        import custom_components.influxdb_query_api.influxdb_service as service
-        service._connection_manager = None
-
-        manager = get_connection_manager(config)
+        manager = get_connection_manager(hass, config)
 
         assert manager is not None
-        assert service._connection_manager == manager
+        assert hass.data[DOMAIN][DATA_CONNECTION_MANAGER] is manager
 
-    def test_get_connection_manager_returns_existing(self, config):
+    def test_get_connection_manager_returns_existing(self, hass, config):
         """Test connection manager returns existing instance."""
-        # Set global variable
-        import custom_components.influxdb_query_api.influxdb_service as service
         existing_manager = Mock()
-        service._connection_manager = existing_manager
+        hass.data[DOMAIN] = {DATA_CONNECTION_MANAGER: existing_manager}
 
-        manager = get_connection_manager(config)
+        manager = get_connection_manager(hass, config)
 
         assert manager == existing_manager
 
-    def test_get_connection_status_not_initialized(self):
-        """Test connection status when not initialized."""
-        import custom_components.influxdb_query_api.influxdb_service as service
-        service._connection_manager = None
+    def test_get_connection_manager_per_hass_instance(self, config):
+        """Test separate hass instances do not share a connection manager."""
+        first_hass, second_hass = Mock(), Mock()
+        first_hass.data, second_hass.data = {}, {}
+
+        assert get_connection_manager(first_hass, config) is not get_connection_manager(second_hass, config)
 
-        status = get_connection_status()
+    def test_get_connection_status_not_initialized(self, hass):
+        """Test connection status when not initialized."""
+        status = get_connection_status(hass)
         assert status == {"status": "Not initialized"}
 
-    def test_get_connection_status_initialized(self):
+    def test_get_connection_status_initialized(self, hass):
         """Test connection status when initialized."""
-        import custom_components.influxdb_query_api.influxdb_service as service
         mock_manager = Mock()
         mock_manager.get_pool_status.return_value = {"status": "active", "connections": 3}
-        service._connection_manager = mock_manager
+        hass.data[DOMAIN] = {DATA_CONNECTION_MANAGER: mock_manager}
 
-        status = get_connection_status()
+        status = get_connection_status(hass)
         assert status == {"status": "active", "connections": 3}
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.get_connection_manager')
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @patch.object(svc.SecurityValidator, 'validate_query_parameters')
     @pytest.mark.asyncio
-    async def test_run_flux_query_success(self, mock_validator, mock_get_manager, config, mock_manager):
+    async def test_run_flux_query_success(self, mock_validate, mock_manager):
         """Test successful query execution."""
-        # Setup mocks
-        mock_get_manager.return_value = mock_manager
-
-        mock_validator.validate_query_parameters.return_value = {
+        mock_validate.return_value = {
             'domain': 'sensor',
             'entity': 'temperature',
             'bucket': 'homeassistant',
@@ -92,10 +123,10 @@ class TestInfluxDBService:
             'range_stop': 'now()'
         }
 
-        result = await run_flux_query(config, 'sensor.temperature', '-1h', 'now()')
+        result = await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
 
         # Verify validation was called
-        mock_validator.validate_query_parameters.assert_called_once_with({
+        mock_validate.assert_called_once_with({
             'entity_id': 'sensor.temperature',
             'bucket': 'homeassistant',
             'range_start': '-1h',
@@ -103,31 +134,167 @@ class TestInfluxDBService:
         })
 
         # Verify manager was used
-        mock_manager.execute_query.assert_called_once()
+        assert len(mock_manager.calls) == 1
 
         # Verify result
         assert len(result) == 2
         assert result[0]["time"] == "2025-01-10T12:00:00Z"
         assert result[0]["value"] == 25.5
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
     @pytest.mark.asyncio
-    async def test_run_flux_query_validation_error(self, mock_validator, config):
+    async def test_run_flux_query_coalesces_identical_queries(self, mock_manager):
+        """Test concurrent identical queries are sent to InfluxDB once."""
+
+        results = await asyncio.gather(
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            run_flux_query(mock_manager, 'sensor.temperature', '-2h', 'now()'),
+        )
+
+        assert len(mock_manager.calls) == 2
+        assert results[0] == results[1] == results[2]
+
+    @pytest.mark.asyncio
+    async def test_run_flux_query_serves_cached_result(self, mock_manager):
+        """Test repeated queries are answered from the result cache."""
+
+        first = await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
+        second = await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
+
+        assert len(mock_manager.calls) == 1
+        assert first == second
+
+    @pytest.mark.asyncio
+    async def test_run_flux_query_cache_per_manager(self, config, mock_manager):
+        """Test managers do not share cached results or in-flight queries."""
+        other_manager = _FakeManager(config, [{"time": "2025-01-10T12:00:00Z", "value": 99.0}])
+
+        first, other = await asyncio.gather(
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            run_flux_query(other_manager, 'sensor.temperature', '-1h', 'now()'),
+        )
+        await run_flux_query(other_manager, 'sensor.temperature', '-1h', 'now()')
+
+        assert len(mock_manager.calls) == len(other_manager.calls) == 1
+        assert first == mock_manager.result
+        assert other == other_manager.result
+
+    @pytest.mark.asyncio
+    async def test_cleanup_connections_keeps_other_caches(self, hass, config, mock_manager):
+        """Test cleaning up one hass instance leaves other managers' caches alone."""
+        hass.data[DOMAIN] = {DATA_CONNECTION_MANAGER: Mock(cleanup=AsyncMock())}
+        await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
+
+        await cleanup_connections(hass)
+        await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
+
+        assert len(mock_manager.calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_run_flux_query_cache_disabled(self, config, mock_manager):
+        """Test a cache TTL of zero sends every query to InfluxDB."""
+        config["cache_ttl"] = 0
+
+        await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
+        await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
+
+        assert len(mock_manager.calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_run_flux_query_batches_entities(self, config, mock_manager):
+        """Test concurrent queries for one domain and range are sent as one query."""
+        config["batch_window"] = 0.02
+        mock_manager.grouped_result = {
+            "temperature": [{"time": "2025-01-10T12:00:00Z", "value": 25.5}],
+            "humidity": [{"time": "2025-01-10T12:00:00Z", "value": 40.0}],
+        }
+
+        temperature, humidity, door = await asyncio.gather(
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            run_flux_query(mock_manager, 'sensor.humidity', '-1h', 'now()'),
+            run_flux_query(mock_manager, 'sensor.door', '-1h', 'now()'),
+        )
+
+        assert len(mock_manager.grouped_calls) == 1
+        query, column = mock_manager.grouped_calls[0]
+        assert ('(r["entity_id"] == "door" or r["entity_id"] == "humidity" or r["entity_id"] == "temperature")'
+                in query)
+        assert "contains(" not in query
+        assert column == "entity_id"
+        assert mock_manager.calls == []
+
+        assert temperature == [{"time": "2025-01-10T12:00:00Z", "value": 25.5}]
+        assert humidity == [{"time": "2025-01-10T12:00:00Z", "value": 40.0}]
+        assert door == []
+
+        # Each entity's result is cached as if it was queried on its own
+        await run_flux_query(mock_manager, 'sensor.humidity', '-1h', 'now()')
+        assert len(mock_manager.grouped_calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_run_flux_queries(self, mock_manager):
+        """Test querying a list of entities returns results keyed by entity ID."""
+        mock_manager.grouped_result = {
+            "temperature": [{"time": "2025-01-10T12:00:00Z", "value": 25.5}],
+        }
+
+        result = await run_flux_queries(
+            mock_manager, ['sensor.temperature', 'sensor.humidity', 'sensor.temperature'], '-1h', 'now()'
+        )
+
+        # Batched even without a batch window, as all entities are known up front
+        assert len(mock_manager.grouped_calls) == 1
+        assert mock_manager.calls == []
+
+        assert result == {
+            'sensor.temperature': [{"time": "2025-01-10T12:00:00Z", "value": 25.5}],
+            'sensor.humidity': [],
+        }
+
+    @pytest.mark.asyncio
+    async def test_run_flux_query_not_batched_by_default(self, mock_manager):
+        """Test separate requests are sent a query each unless a batch window is configured."""
+        await asyncio.gather(
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            run_flux_query(mock_manager, 'sensor.humidity', '-1h', 'now()'),
+        )
+
+        assert len(mock_manager.calls) == 2
+
+    def test_get_cache_ttl(self, config):
+        """Test absolute time ranges are cached longer than relative ones."""
+        assert _get_cache_ttl(config, '-1h', 'now()') == 5
+        assert _get_cache_ttl(config, '2025-01-10T00:00:00Z', 'now()') == 5
+        assert _get_cache_ttl(config, '2025-01-10T00:00:00Z', '2025-01-10T23:59:59Z') == 60
+
+    @pytest.mark.asyncio
+    async def test_run_flux_query_coalesced_error(self, mock_manager):
+        """Test a failed query is reported to every coalesced caller."""
+        mock_manager.error = Exception("Connection failed")
+
+        results = await asyncio.gather(
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()'),
+            return_exceptions=True
+        )
+
+        assert len(mock_manager.calls) == 1
+        assert all("Query execution failed: Connection failed" in str(r) for r in results)
+
+    @patch.object(svc, 'SecurityValidator')
+    @pytest.mark.asyncio
+    async def test_run_flux_query_validation_error(self, mock_validator, mock_manager):
         """Test query execution with validation error."""
         mock_validator.validate_query_parameters.side_effect = ValueError("Invalid entity ID")
 
         with pytest.raises(ValueError, match="Input validation failed: Invalid entity ID"):
-            await run_flux_query(config, 'invalid_entity', '-1h', 'now()')
+            await run_flux_query(mock_manager, 'invalid_entity', '-1h', 'now()')
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.get_connection_manager')
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @patch.object(svc.SecurityValidator, 'validate_query_parameters')
     @pytest.mark.asyncio
-    async def test_run_flux_query_database_error(self, mock_validator, mock_get_manager, config, mock_manager):
+    async def test_run_flux_query_database_error(self, mock_validate, mock_manager):
         """Test query execution with database error."""
-        # Setup mocks
-        mock_get_manager.return_value = mock_manager
-
-        mock_validator.validate_query_parameters.return_value = {
+        mock_validate.return_value = {
             'domain': 'sensor',
             'entity': 'temperature',
             'bucket': 'homeassistant',
@@ -135,14 +302,15 @@ class TestInfluxDBService:
             'range_stop': 'now()'
         }
 
-        mock_manager.execute_query.side_effect = Exception("Connection failed")
+        mock_manager.error = Exception("Connection failed")
 
         with pytest.raises(Exception, match="Query execution failed: Connection failed"):
-            await run_flux_query(config, 'sensor.temperature', '-1h', 'now()')
+            await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @pytest.mark.skipif(not __debug__, reason="the final injection check is stripped under -O")
+    @patch.object(svc, 'SecurityValidator')
     @pytest.mark.asyncio
-    async def test_run_flux_query_injection_detected(self, mock_validator, config):
+    async def test_run_flux_query_injection_detected(self, mock_validator, mock_manager):
         """Test query execution when injection is detected after validation."""
         mock_validator.validate_query_parameters.return_value = {
             'domain': 'sensor',
@@ -155,63 +323,68 @@ class TestInfluxDBService:
         # Mock check_for_injection_attempts to return True
         mock_validator.check_for_injection_attempts.return_value = True
 
-        with pytest.raises(ValueError, match="Potentially dangerous query detected"):
-            await run_flux_query(config, 'sensor.temperature', '-1h', 'now()')
+        with pytest.raises(Exception, match="Query execution failed: Potentially dangerous query detected"):
+            await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
 
-    def test_build_safe_query(self):
+    @pytest.mark.parametrize("bucket,domain,entity,start,stop", [
+        ("homeassistant", "sensor", "temperature", "-1h", "now()"),
+        ("bucket", "sensor", "temp_01", "-1h", "now()"),
+        ("home-assistant", "binary_sensor", "front_door", "-7d", "-1d"),
+        ("homeassistant", "sensor", "temperature", "2025-01-10T00:00:00Z", "2025-01-10T23:59:59Z"),
+    ])
+    def test_build_safe_query(self, bucket, domain, entity, start, stop):
         """Test safe query building."""
-        query = _build_safe_query("homeassistant", "sensor", "temperature", "-1h", "now()")
+        query = _build_safe_query(bucket, domain, entity, start, stop)
+
+        assert query == EXPECTED_QUERY_TEMPLATE.format(
+            bucket=bucket, domain=domain, entity=entity, start=start, stop=stop
+        )
 
-        expected = '''from(bucket: "homeassistant")
-    |> range(start: -1h, stop: now())
-    |> filter(fn: (r) => r["_measurement"] == "sensor" and r["entity_id"] == "temperature" and r["_field"] == "value")'''
+    def test_build_safe_query_reuses_template(self):
+        """Test the query template is built once per entity and reused across time ranges."""
+        first = _build_safe_query("homeassistant", "sensor", "temperature", "-1h", "now()")
+        second = _build_safe_query("homeassistant", "sensor", "temperature", "-24h", "-1h")
 
-        assert query == expected
+        assert "range(start: -1h, stop: now())" in first
+        assert "range(start: -24h, stop: -1h)" in second
+        assert _safe_template.cache_info().misses == 1
+        assert _safe_template.cache_info().hits == 1
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @pytest.mark.skipif(not __debug__, reason="the final injection check is stripped under -O")
+    @patch.object(svc, 'SecurityValidator')
     def test_build_safe_query_injection_detected(self, mock_validator):
         """Test safe query building detects injection."""
         mock_validator.build_safe_filter.return_value = 'r["_measurement"] == "sensor"'
         mock_validator.check_for_injection_attempts.return_value = True
 
-        with pytest.raises(ValueError, match="Potentially dangerous query detected"):
+        with pytest.raises(AssertionError, match="Potentially dangerous query detected"):
             _build_safe_query("homeassistant", "sensor", "temperature", "-1h", "now()")
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
     @pytest.mark.asyncio
-    async def test_cleanup_connections(self, mock_validator):
+    async def test_cleanup_connections(self, hass):
         """Test connection cleanup."""
         # Setup mock manager
         mock_manager = Mock()
         mock_manager.cleanup = AsyncMock()
+        hass.data[DOMAIN] = {DATA_CONNECTION_MANAGER: mock_manager}
 
-        import custom_components.influxdb_query_api.influxdb_service as service
-        service._connection_manager = mock_manager
-
-        await cleanup_connections()
+        await cleanup_connections(hass)
 
         mock_manager.cleanup.assert_called_once()
-        assert service._connection_manager is None
+        assert DATA_CONNECTION_MANAGER not in hass.data[DOMAIN]
 
     @pytest.mark.asyncio
-    async def test_cleanup_connections_no_manager(self):
+    async def test_cleanup_connections_no_manager(self, hass):
         """Test connection cleanup when no manager exists."""
-        import custom_components.influxdb_query_api.influxdb_service as service
-        service._connection_manager = None
-
         # Should not raise error
-        await cleanup_connections()
-        assert service._connection_manager is None
+        await cleanup_connections(hass)
+        assert get_connection_status(hass) == {"status": "Not initialized"}
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.get_connection_manager')
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @patch.object(svc.SecurityValidator, 'validate_query_parameters')
     @pytest.mark.asyncio
-    async def test_query_with_different_field_types(self, mock_validator, mock_get_manager, config, mock_manager):
+    async def test_query_with_different_field_types(self, mock_validate, mock_manager):
         """Test query execution with different field value types."""
-        # Setup mocks
-        mock_get_manager.return_value = mock_manager
-
-        mock_validator.validate_query_parameters.return_value = {
+        mock_validate.return_value = {
             'domain': 'sensor',
             'entity': 'temperature',
             'bucket': 'homeassistant',
@@ -220,14 +393,14 @@ class TestInfluxDBService:
         }
 
         # Mock different value types
-        mock_manager.execute_query.return_value = [
+        mock_manager.result = [
             {"time": "2025-01-10T12:00:00Z", "value": 25.5},      # float
             {"time": "2025-01-10T12:05:00Z", "value": "on"},      # string
             {"time": "2025-01-10T12:10:00Z", "value": True},      # boolean
             {"time": "2025-01-10T12:15:00Z", "value": 42},        # integer
         ]
 
-        result = await run_flux_query(config, 'sensor.temperature', '-1h', 'now()')
+        result = await run_flux_query(mock_manager, 'sensor.temperature', '-1h', 'now()')
 
         assert len(result) == 4
         assert result[0]["value"] == 25.5
@@ -235,15 +408,11 @@ class TestInfluxDBService:
         assert result[2]["value"] is True
         assert result[3]["value"] == 42
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.get_connection_manager')
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @patch.object(svc.SecurityValidator, 'validate_query_parameters')
     @pytest.mark.asyncio
-    async def test_query_empty_result(self, mock_validator, mock_get_manager, config, mock_manager):
+    async def test_query_empty_result(self, mock_validate, mock_manager):
         """Test query execution with empty result."""
-        # Setup mocks
-        mock_get_manager.return_value = mock_manager
-
-        mock_validator.validate_query_parameters.return_value = {
+        mock_validate.return_value = {
             'domain': 'sensor',
             'entity': 'nonexistent',
             'bucket': 'homeassistant',
@@ -252,21 +421,17 @@ class TestInfluxDBService:
         }
 
         # Mock empty result
-        mock_manager.execute_query.return_value = []
+        mock_manager.result = []
 
-        result = await run_flux_query(config, 'sensor.nonexistent', '-1h', 'now()')
+        result = await run_flux_query(mock_manager, 'sensor.nonexistent', '-1h', 'now()')
 
         assert result == []
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.get_connection_manager')
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @patch.object(svc.SecurityValidator, 'validate_query_parameters')
     @pytest.mark.asyncio
-    async def test_query_complex_time_ranges(self, mock_validator, mock_get_manager, config, mock_manager):
+    async def test_query_complex_time_ranges(self, mock_validate, mock_manager):
         """Test query execution with complex time range expressions."""
-        # Setup mocks
-        mock_get_manager.return_value = mock_manager
-
-        mock_validator.validate_query_parameters.return_value = {
+        mock_validate.return_value = {
             'domain': 'sensor',
             'entity': 'temperature',
             'bucket': 'homeassistant',
@@ -274,17 +439,17 @@ class TestInfluxDBService:
             'range_stop': '2025-01-10T23:59:59Z'
         }
 
-        mock_manager.execute_query.return_value = [{"time": "2025-01-10T12:00:00Z", "value": 25.5}]
+        mock_manager.result = [{"time": "2025-01-10T12:00:00Z", "value": 25.5}]
 
         result = await run_flux_query(
-            config,
+            mock_manager,
             'sensor.temperature',
             '2025-01-10T00:00:00Z',
             '2025-01-10T23:59:59Z'
         )
 
         # Verify time ranges were validated and used
-        mock_validator.validate_query_parameters.assert_called_once_with({
+        mock_validate.assert_called_once_with({
             'entity_id': 'sensor.temperature',
             'bucket': 'homeassistant',
             'range_start': '2025-01-10T00:00:00Z',
@@ -293,10 +458,12 @@ class TestInfluxDBService:
 
         assert len(result) == 1
 
-    @patch('custom_components.influxdb_query_api.influxdb_service.SecurityValidator')
+    @patch.object(svc, 'SecurityValidator')
     def test_build_safe_query_with_special_chars(self, mock_validator):
         """Test safe query building with special characters in identifiers."""
-        mock_validator.build_safe_filter.return_value = 'r["_measurement"] == "sensor" and r["entity_id"] == "temp_01"'
+        mock_validator.build_safe_filter.return_value = (
+            'r["_measurement"] == "sensor" and r["entity_id"] == "temp_01" and r["_field"] == "value"'
+        )
         mock_validator.check_for_injection_attempts.return_value = False
 
         query = _build_safe_query("bucket", "sensor", "temp_01", "-1h", "now()")
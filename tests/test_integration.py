@@ -2,57 +2,93 @@
 Integration tests for the complete system.
 """
 import pytest
+import pytest_asyncio
+from types import MappingProxyType, SimpleNamespace
 from unittest.mock import Mock, patch, AsyncMock
 import asyncio
 import json
 
-from custom_components.influxdb_query_api.influxdb_service import run_flux_query, cleanup_connections
+from custom_components.influxdb_query_api.influxdb_service import (
+    run_flux_query, get_connection_manager, cleanup_connections
+)
 from custom_components.influxdb_query_api.utils import SecurityValidator
+from .conftest import FIXED_TIME, FakeRecord
+
+
+# Complete configuration, exposed read-only through the full_config fixture
+_FULL_CONFIG = {
+    "host": "localhost",
+    "port": "8086",
+    "token": "test-token-123",
+    "organization": "test-org",
+    "bucket": "homeassistant",
+    "timeout": 10000,
+    "ssl": False,
+    "verify_ssl": True,
+    "pool_size": 5,
+    "max_retries": 3
+}
+
+
+# Injection attempts through the entity_id
+MALICIOUS_ENTITY_IDS = (
+    "sensor.temperature'; DROP TABLE measurements; --",
+    "sensor.temperature\" OR 1=1 --",
+    "sensor.temperature'; exec('rm -rf /'); --",
+    "sensor.temperature'; import 'influxdata/influxdb/v1'; --",
+    "sensor.temperature'; system('cat /etc/passwd'); --",
+)
+
+# Injection attempts through the start of the time range
+MALICIOUS_TIME_RANGES = (
+    "2025-01-10T00:00:00Z'; DROP TABLE measurements; --",
+    "-1h'; import 'influxdata/influxdb/v1'; --",
+    "now(); exec('malicious command'); --",
+)
 
 
 class TestIntegration:
     """Integration tests for the complete system."""
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def full_config(self):
-        """Complete configuration."""
-        return {
-            "host": "localhost",
-            "port": "8086",
-            "token": "test-token-123",
-            "organization": "test-org",
-            "bucket": "homeassistant",
-            "timeout": 10000,
-            "ssl": False,
-            "verify_ssl": True,
-            "pool_size": 5,
-            "max_retries": 3
-        }
-
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_end_to_end_secure_query_execution(self, mock_client_class, full_config):
-        """Test complete secure query execution from input to result."""
-        # Mock InfluxDB client and response
-        mock_client = Mock()
-        mock_client.ping.return_value = True
-        mock_client_class.return_value = mock_client
+        """Complete configuration, read-only as it is shared by the tests in this module."""
+        return MappingProxyType(_FULL_CONFIG)
+
+    # The async tests here are independent of each other, so they share one
+    # module-scoped event loop instead of each creating and closing their own
+    @pytest_asyncio.fixture(loop_scope="module")
+    async def hass(self):
+        """Minimal Home Assistant instance; its connections are closed after the test."""
+        hass = Mock()
+        hass.data = {}
+        yield hass
+        await cleanup_connections(hass)
 
-        # Mock query response
-        mock_record = Mock()
-        mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-        mock_record.get_value.return_value = 23.7
+    @pytest.fixture
+    def manager(self, hass, full_config):
+        """Connection manager stored on the test hass instance."""
+        return get_connection_manager(hass, full_config)
 
-        mock_table = Mock()
-        mock_table.records = [mock_record]
+    @pytest.fixture
+    def patched_client(self):
+        """Patched InfluxDB client class and the client it returns, which answers pings."""
+        with patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClientAsync') as mock_client_class:
+            mock_client = AsyncMock()
+            mock_client.ping.return_value = True
+            mock_client_class.return_value = mock_client
+            yield mock_client_class, mock_client
 
-        mock_query_api = Mock()
-        mock_query_api.query.return_value = [mock_table]
-        mock_client.query_api.return_value = mock_query_api
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_end_to_end_secure_query_execution(self, patched_client, make_query_api, manager):
+        """Test complete secure query execution from input to result."""
+        _, mock_client = patched_client
+        mock_query_api = make_query_api([FakeRecord(23.7)])
+        mock_client.query_api = Mock(return_value=mock_query_api)
 
         # Execute query
         result = await run_flux_query(
-            full_config,
+            manager,
             "sensor.living_room_temperature",
             "-1h",
             "now()"
@@ -60,7 +96,7 @@ class TestIntegration:
 
         # Verify result
         assert len(result) == 1
-        assert result[0]["time"] == "2025-01-10T12:00:00Z"
+        assert result[0]["time"] == FIXED_TIME
         assert result[0]["value"] == 23.7
 
         # Verify query was secure (no injection)
@@ -69,107 +105,71 @@ class TestIntegration:
         assert "range(start: -1h, stop: now())" in call_args
         assert "r[\"_measurement\"] == \"sensor\"" in call_args
         assert "r[\"entity_id\"] == \"living_room_temperature\"" in call_args
-
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_security_validation_prevents_injection(self, mock_client_class, full_config):
-        """Test that security validation prevents injection attacks."""
-        # Mock client
-        mock_client = Mock()
-        mock_client.ping.return_value = True
-        mock_client_class.return_value = mock_client
-
-        mock_query_api = Mock()
-        mock_client.query_api.return_value = mock_query_api
-
-        # Attempt injection through entity_id
-        malicious_inputs = [
-            "sensor.temperature'; DROP TABLE measurements; --",
-            "sensor.temperature\" OR 1=1 --",
-            "sensor.temperature'; exec('rm -rf /'); --",
-            "sensor.temperature'; import 'influxdata/influxdb/v1'; --",
-            "sensor.temperature'; system('cat /etc/passwd'); --"
-        ]
-
-        for malicious_input in malicious_inputs:
-            with pytest.raises(ValueError, match="Input validation failed"):
-                await run_flux_query(
-                    full_config,
-                    malicious_input,
-                    "-1h",
-                    "now()"
-                )
+        assert "keep(columns: [\"_time\", \"_value\"])" in call_args
+
+    @pytest.mark.parametrize("malicious", MALICIOUS_ENTITY_IDS)
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_security_validation_prevents_injection(self, malicious, patched_client, make_query_api, manager):
+        """Test that security validation prevents injection attacks through entity_id."""
+        _, mock_client = patched_client
+        mock_query_api = make_query_api([])
+        mock_client.query_api = Mock(return_value=mock_query_api)
+
+        with pytest.raises(ValueError, match="Input validation failed"):
+            await run_flux_query(
+                manager,
+                malicious,
+                "-1h",
+                "now()"
+            )
 
         # Verify no queries were executed
         mock_query_api.query.assert_not_called()
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_time_range_injection_prevention(self, mock_client_class, full_config):
+    @pytest.mark.parametrize("malicious", MALICIOUS_TIME_RANGES)
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_time_range_injection_prevention(self, malicious, patched_client, make_query_api, manager):
         """Test that injection through time range parameters is prevented."""
-        mock_client = Mock()
-        mock_client.ping.return_value = True
-        mock_client_class.return_value = mock_client
-
-        mock_query_api = Mock()
-        mock_client.query_api.return_value = mock_query_api
-
-        # Attempt injection through time range
-        malicious_time_ranges = [
-            "2025-01-10T00:00:00Z'; DROP TABLE measurements; --",
-            "-1h'; import 'influxdata/influxdb/v1'; --",
-            "now(); exec('malicious command'); --"
-        ]
-
-        for malicious_start in malicious_time_ranges:
-            with pytest.raises(ValueError, match="Input validation failed"):
-                await run_flux_query(
-                    full_config,
-                    "sensor.temperature",
-                    malicious_start,
-                    "now()"
-                )
+        _, mock_client = patched_client
+        mock_query_api = make_query_api([])
+        mock_client.query_api = Mock(return_value=mock_query_api)
+
+        with pytest.raises(ValueError, match="Input validation failed"):
+            await run_flux_query(
+                manager,
+                "sensor.temperature",
+                malicious,
+                "now()"
+            )
 
         # Verify no queries were executed
         mock_query_api.query.assert_not_called()
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_connection_pool_management(self, mock_client_class, full_config):
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_connection_pool_management(self, patched_client, manager):
         """Test connection pool management during multiple queries."""
-        # Create multiple mock clients
-        mock_clients = []
-        for i in range(3):
-            mock_client = Mock()
+        mock_client_class, _ = patched_client
+
+        # Mock query response for all clients, one record per entity in the query
+        queries = []
+
+        def query_response(query):
+            queries.append(query)
+            records = [
+                FakeRecord(25.0, values={"entity_id": entity})
+                for entity in ("temperature", "humidity", "motion")
+                if f'"{entity}"' in query
+            ]
+            return [SimpleNamespace(records=records)]
+
+        # Create multiple mock clients, each wired to its own query_api up front
+        query_apis = [AsyncMock() for _ in range(3)]
+        mock_clients = [AsyncMock(query_api=Mock(return_value=query_api)) for query_api in query_apis]
+        for mock_client, query_api in zip(mock_clients, query_apis):
             mock_client.ping.return_value = True
-            mock_clients.append(mock_client)
-
+            query_api.query.side_effect = query_response
         mock_client_class.side_effect = mock_clients
 
-        # Mock query response for all clients
-        mock_record = Mock()
-        mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-        mock_record.get_value.return_value = 25.0
-
-        mock_table = Mock()
-        mock_table.records = [mock_record]
-
-        # Execute multiple concurrent queries
-        async def execute_query(entity_id):
-            mock_query_api = Mock()
-            mock_query_api.query.return_value = [mock_table]
-
-            # Mock the query_api for each client
-            for mock_client in mock_clients:
-                mock_client.query_api.return_value = mock_query_api
-
-            return await run_flux_query(
-                full_config,
-                entity_id,
-                "-1h",
-                "now()"
-            )
-
         # Run concurrent queries
         entity_ids = [
             "sensor.temperature",
@@ -178,7 +178,7 @@ class TestIntegration:
         ]
 
         results = await asyncio.gather(*[
-            execute_query(entity_id) for entity_id in entity_ids
+            run_flux_query(manager, entity_id, "-1h", "now()") for entity_id in entity_ids
         ])
 
         # Verify all queries succeeded
@@ -187,36 +187,29 @@ class TestIntegration:
             assert len(result) == 1
             assert result[0]["value"] == 25.0
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_error_handling_and_recovery(self, mock_client_class, full_config):
+        # Without a batch window every entity is fetched with its own query
+        assert len(queries) == 3
+
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_error_handling_and_recovery(self, patched_client, make_query_api, manager):
         """Test error handling and recovery mechanisms."""
         # Mock client that initially fails then succeeds
-        mock_client = Mock()
+        _, mock_client = patched_client
         mock_client.ping.side_effect = [
             Exception("Initial connection failed"),
             True  # Second ping succeeds
         ]
-        mock_client_class.return_value = mock_client
-
-        # Mock query response
-        mock_record = Mock()
-        mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-        mock_record.get_value.return_value = 24.0
 
-        mock_table = Mock()
-        mock_table.records = [mock_record]
-
-        mock_query_api = Mock()
+        mock_query_api = make_query_api([FakeRecord(24.0)])
         mock_query_api.query.side_effect = [
-            Exception("Query timeout"),
-            [mock_table]  # Second query succeeds
+            asyncio.TimeoutError(),
+            mock_query_api.query.return_value  # Second query succeeds
         ]
-        mock_client.query_api.return_value = mock_query_api
+        mock_client.query_api = Mock(return_value=mock_query_api)
 
         # Execute query - should retry and succeed
         result = await run_flux_query(
-            full_config,
+            manager,
             "sensor.temperature",
             "-1h",
             "now()"
@@ -227,34 +220,19 @@ class TestIntegration:
         assert result[0]["value"] == 24.0
         assert mock_query_api.query.call_count == 2  # Should retry once
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_data_type_handling(self, mock_client_class, full_config):
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_data_type_handling(self, patched_client, make_query_api, manager):
         """Test handling of different data types in query results."""
-        mock_client = Mock()
-        mock_client.ping.return_value = True
-        mock_client_class.return_value = mock_client
+        _, mock_client = patched_client
 
         # Mock records with different data types
-        mock_records = []
         test_values = [25.5, "on", True, False, None, 42, "off", 0, "unknown"]
-
-        for value in test_values:
-            mock_record = Mock()
-            mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-            mock_record.get_value.return_value = value
-            mock_records.append(mock_record)
-
-        mock_table = Mock()
-        mock_table.records = mock_records
-
-        mock_query_api = Mock()
-        mock_query_api.query.return_value = [mock_table]
-        mock_client.query_api.return_value = mock_query_api
+        records = [FakeRecord(value) for value in test_values]
+        mock_client.query_api = Mock(return_value=make_query_api(records))
 
         # Execute query
         result = await run_flux_query(
-            full_config,
+            manager,
             "sensor.mixed_types",
             "-1h",
             "now()"
@@ -265,93 +243,81 @@ class TestIntegration:
         for i, expected_value in enumerate(test_values):
             assert result[i]["value"] == expected_value
 
-    @patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient')
-    @pytest.mark.asyncio
-    async def test_performance_with_large_datasets(self, mock_client_class, full_config):
-        """Test performance with large datasets."""
-        mock_client = Mock()
-        mock_client.ping.return_value = True
-        mock_client_class.return_value = mock_client
-
-        # Create large dataset
-        mock_records = []
-        for i in range(1000):  # 1000 records
-            mock_record = Mock()
-            mock_record.get_time.return_value.isoformat.return_value = f"2025-01-10T12:{i%60:02d}:00Z"
-            mock_record.get_value.return_value = 20.0 + (i % 10)  # Values between 20-29
-            mock_records.append(mock_record)
-
-        mock_table = Mock()
-        mock_table.records = mock_records
-
-        mock_query_api = Mock()
-        mock_query_api.query.return_value = [mock_table]
-        mock_client.query_api.return_value = mock_query_api
-
-        # Execute query and measure performance
-        import time
-        start_time = time.time()
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_multiple_records_returned_in_order(self, patched_client, make_query_api, manager):
+        """Test every record of a query result is returned, in order."""
+        _, mock_client = patched_client
+
+        records = [
+            FakeRecord(20.0 + i, f"2025-01-10T12:{i:02d}:00Z")
+            for i in range(10)
+        ]
+        mock_client.query_api = Mock(return_value=make_query_api(records))
 
         result = await run_flux_query(
-            full_config,
+            manager,
             "sensor.high_frequency",
             "-1h",
             "now()"
         )
 
-        end_time = time.time()
-        execution_time = end_time - start_time
+        # Verify data integrity
+        assert result == [
+            {"time": f"2025-01-10T12:{i:02d}:00Z", "value": 20.0 + i}
+            for i in range(10)
+        ]
 
-        # Verify results
-        assert len(result) == 1000
-        assert execution_time < 5.0  # Should complete within 5 seconds
+    @pytest.mark.benchmark(group="run_flux_query")
+    def test_query_benchmark(self, benchmark, patched_client, make_query_api, full_config):
+        """Benchmark a 1000 record query through run_flux_query; skipped outside the benchmark run."""
+        _, mock_client = patched_client
+        records = [FakeRecord(20.0 + (i % 10), i) for i in range(1000)]
+        mock_client.query_api = Mock(return_value=make_query_api(records))
+
+        hass = Mock()
+        hass.data = {}
+        # Without caching every round takes the full query path instead of a cache hit
+        manager = get_connection_manager(hass, {**full_config, "cache_ttl": 0})
+
+        # The benchmark fixture is synchronous, so each round runs the query on a loop of its own
+        with asyncio.Runner() as runner:
+            try:
+                result = benchmark(
+                    lambda: runner.run(run_flux_query(manager, "sensor.high_frequency", "-1h", "now()"))
+                )
+            finally:
+                runner.run(cleanup_connections(hass))
 
-        # Verify data integrity
-        for i, record in enumerate(result):
-            expected_value = 20.0 + (i % 10)
-            assert record["value"] == expected_value
+        assert len(result) == 1000
+        # Every round reached InfluxDB rather than the result cache
+        assert mock_client.query_api.return_value.query.await_count >= benchmark.stats.stats.rounds
 
-    @pytest.mark.asyncio
-    async def test_cleanup_and_resource_management(self, full_config):
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_cleanup_and_resource_management(self, patched_client, make_query_api, hass, full_config):
         """Test cleanup and resource management."""
-        # This test doesn't mock InfluxDBClient to test actual cleanup
+        _, mock_client = patched_client
+        mock_client.query_api = Mock(return_value=make_query_api([FakeRecord(25.0)]))
 
         # We'll use a shorter timeout for testing
-        test_config = full_config.copy()
-        test_config["timeout"] = 1000  # 1 second timeout
+        test_config = {**full_config, "timeout": 1000}  # 1 second timeout
 
         try:
             # Execute a query to initialize connection manager
-            with patch('custom_components.influxdb_query_api.influxdb_client.InfluxDBClient') as mock_client_class:
-                mock_client = Mock()
-                mock_client.ping.return_value = True
-                mock_client_class.return_value = mock_client
-
-                mock_record = Mock()
-                mock_record.get_time.return_value.isoformat.return_value = "2025-01-10T12:00:00Z"
-                mock_record.get_value.return_value = 25.0
-
-                mock_table = Mock()
-                mock_table.records = [mock_record]
-
-                mock_query_api = Mock()
-                mock_query_api.query.return_value = [mock_table]
-                mock_client.query_api.return_value = mock_query_api
-
-                result = await run_flux_query(
-                    test_config,
-                    "sensor.temperature",
-                    "-1h",
-                    "now()"
-                )
-                assert len(result) == 1
+            result = await run_flux_query(
+                get_connection_manager(hass, test_config),
+                "sensor.temperature",
+                "-1h",
+                "now()"
+            )
+            assert len(result) == 1
 
             # Now test cleanup
-            await cleanup_connections()
+            await cleanup_connections(hass)
+            mock_client.close.assert_awaited()
 
         except Exception as e:
             # Cleanup should not raise exceptions even if connection fails
-            await cleanup_connections()
+            await cleanup_connections(hass)
             pytest.fail(f"Test failed with exception: {e}")
 
     def test_security_validator_isolation(self):
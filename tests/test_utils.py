@@ -5,6 +5,92 @@ import pytest
 from custom_components.influxdb_query_api.utils import SecurityValidator
 
 
+# Identifiers with dangerous characters and what remains after sanitization
+SANITIZE_CASES = (
+    ('sensor"name', "sensorname"),
+    ("sensor'sensor", "sensorsensor"),
+    ("sensor`command", "sensorcommand"),
+    ("sensor\\path", "sensorpath"),
+    ("sensor;drop", "sensordrop"),
+    ("sensor|pipe", "sensorpipe"),
+    ("sensor>redirect", "sensorredirect"),
+)
+
+# Valid entity IDs and their (domain, entity) parts
+VALID_ENTITY_IDS = (
+    ("sensor.temperature", ("sensor", "temperature")),
+    ("binary_sensor.front_door", ("binary_sensor", "front_door")),
+    ("light.living_room_main_01", ("light", "living_room_main_01")),
+)
+
+# Invalid entity IDs and the error they are rejected with
+INVALID_ENTITY_IDS = (
+    pytest.param("sensortemperature", "must contain '.' separator", id="missing-dot"),
+    pytest.param(".temperature", "Invalid domain", id="empty-domain"),
+    pytest.param("sensor.", "Invalid entity", id="empty-entity"),
+    pytest.param("sensor-temp.temperature", "Invalid domain", id="domain-chars"),
+    pytest.param("sensor.temp-sensor", "Invalid entity", id="entity-chars"),
+    pytest.param(123, "must be a non-empty string", id="non-string"),
+    pytest.param("", "must be a non-empty string", id="empty"),
+    pytest.param(f"{'a' * 51}.entity", "Domain too long", id="long-domain"),
+    pytest.param(f"sensor.{'a' * 101}", "Entity too long", id="long-entity"),
+)
+
+# Bucket names accepted unchanged
+VALID_BUCKET_NAMES = ("homeassistant", "bucket_01", "my-bucket", "Bucket_Name_123")
+
+# Invalid bucket names and the error they are rejected with
+INVALID_BUCKET_NAMES = (
+    pytest.param("", "must be a non-empty string", id="empty"),
+    pytest.param(123, "must be a non-empty string", id="non-string"),
+    pytest.param("bucket.name", "Invalid bucket name", id="dot"),
+    pytest.param("bucket name", "Invalid bucket name", id="space"),
+    pytest.param("a" * 101, "Bucket name too long", id="too-long"),
+)
+
+# Empty or non-string time ranges and the error they are rejected with
+INVALID_TIME_RANGES = (
+    pytest.param("", "now()", "cannot be empty", id="empty-start"),
+    pytest.param("-1h", "", "cannot be empty", id="empty-stop"),
+    pytest.param(123, "now()", "must be strings", id="non-string"),
+)
+
+# Time range expressions rejected as dangerous
+DANGEROUS_TIME_RANGES = (
+    "import('influxdata/influxdb/v1')",
+    "from(bucket: 'test')",
+    "buckets()",
+    "drop()",
+    "delete()",
+    "org()",
+    "token()",
+    "exec('rm -rf /')",
+    "eval('malicious code')",
+    "system('hack')",
+)
+
+# Queries not detected as injection attempts
+SAFE_QUERIES = (
+    'from(bucket: "test") |> range(start: -1h)',
+    'r["_measurement"] == "sensor" and r["entity_id"] == "test"',
+    'from(bucket: "homeassistant") |> filter(fn: (r) => r._value > 0)',
+)
+
+# Queries detected as injection attempts
+DANGEROUS_QUERIES = (
+    'import "influxdata/influxdb/v1"',
+    'from(bucket: "test") |> drop()',
+    'exec("rm -rf /")',
+    'eval("malicious")',
+    'drop table users',
+    'delete from measurements',
+    'union select * from passwords',
+    '<script>alert("xss")</script>',
+    'javascript:alert("xss")',
+    'data:text/html,<script>alert("xss")</script>',
+)
+
+
 class TestSecurityValidator:
     """Test cases for SecurityValidator class."""
 
@@ -15,15 +101,10 @@ class TestSecurityValidator:
         assert SecurityValidator.sanitize_identifier("temp_sensor_01") == "temp_sensor_01"
         assert SecurityValidator.sanitize_identifier("  sensor  ") == "sensor"
 
-    def test_sanitize_identifier_dangerous_chars(self):
+    @pytest.mark.parametrize("raw,expected", SANITIZE_CASES)
+    def test_sanitize_identifier_dangerous_chars(self, raw, expected):
         """Test removal of dangerous characters."""
-        assert SecurityValidator.sanitize_identifier('sensor"name') == "sensorname"
-        assert SecurityValidator.sanitize_identifier("sensor'sensor") == "sensorsensor"
-        assert SecurityValidator.sanitize_identifier("sensor`command") == "sensorcommand"
-        assert SecurityValidator.sanitize_identifier("sensor\\path") == "sensorpath"
-        assert SecurityValidator.sanitize_identifier("sensor;drop") == "sensordrop"
-        assert SecurityValidator.sanitize_identifier("sensor|pipe") == "sensorpipe"
-        assert SecurityValidator.sanitize_identifier("sensor>redirect") == "sensorredirect"
+        assert SecurityValidator.sanitize_identifier(raw) == expected
 
     def test_sanitize_identifier_invalid_inputs(self):
         """Test sanitization rejects invalid inputs."""
@@ -45,85 +126,36 @@ class TestSecurityValidator:
         with pytest.raises(ValueError, match="Value too long"):
             SecurityValidator.sanitize_identifier(long_string)
 
-    def test_validate_entity_id_valid_cases(self):
+    def test_escape_value(self):
+        """Test escaping of quotes, backslashes and control characters."""
+        assert SecurityValidator.escape_value("mean") == "mean"
+        assert SecurityValidator.escape_value('say "hi"') == 'say \\"hi\\"'
+        assert SecurityValidator.escape_value("it's") == "it\\'s"
+        assert SecurityValidator.escape_value("a\\b") == "a\\\\b"
+        assert SecurityValidator.escape_value("line\nnext\ttab") == "line\\nnext\\ttab"
+        assert SecurityValidator.escape_value(42) == "42"
+
+    @pytest.mark.parametrize("entity_id,expected", VALID_ENTITY_IDS)
+    def test_validate_entity_id_valid_cases(self, entity_id, expected):
         """Test validation of valid entity IDs."""
-        # Normal cases
-        domain, entity = SecurityValidator.validate_entity_id("sensor.temperature")
-        assert domain == "sensor"
-        assert entity == "temperature"
+        assert SecurityValidator.validate_entity_id(entity_id) == expected
 
-        domain, entity = SecurityValidator.validate_entity_id("binary_sensor.front_door")
-        assert domain == "binary_sensor"
-        assert entity == "front_door"
-
-        domain, entity = SecurityValidator.validate_entity_id("light.living_room_main_01")
-        assert domain == "light"
-        assert entity == "living_room_main_01"
-
-    def test_validate_entity_id_invalid_cases(self):
+    @pytest.mark.parametrize("entity_id,match", INVALID_ENTITY_IDS)
+    def test_validate_entity_id_invalid_cases(self, entity_id, match):
         """Test validation rejects invalid entity IDs."""
-        # Missing dot
-        with pytest.raises(ValueError, match="must contain '.' separator"):
-            SecurityValidator.validate_entity_id("sensortemperature")
-
-        # Empty parts
-        with pytest.raises(ValueError, match="Invalid domain"):
-            SecurityValidator.validate_entity_id(".temperature")
+        with pytest.raises(ValueError, match=match):
+            SecurityValidator.validate_entity_id(entity_id)
 
-        with pytest.raises(ValueError, match="Invalid entity"):
-            SecurityValidator.validate_entity_id("sensor.")
-
-        # Invalid characters
-        with pytest.raises(ValueError, match="Invalid domain"):
-            SecurityValidator.validate_entity_id("sensor-temp.temperature")
-
-        with pytest.raises(ValueError, match="Invalid entity"):
-            SecurityValidator.validate_entity_id("sensor.temp-sensor")
-
-        # Non-string input
-        with pytest.raises(ValueError, match="must be a non-empty string"):
-            SecurityValidator.validate_entity_id(123)
-
-        # Empty string
-        with pytest.raises(ValueError, match="must be a non-empty string"):
-            SecurityValidator.validate_entity_id("")
-
-        # Too long
-        long_domain = "a" * 51
-        with pytest.raises(ValueError, match="Domain too long"):
-            SecurityValidator.validate_entity_id(f"{long_domain}.entity")
-
-        long_entity = "a" * 101
-        with pytest.raises(ValueError, match="Entity too long"):
-            SecurityValidator.validate_entity_id(f"sensor.{long_entity}")
-
-    def test_validate_bucket_name_valid_cases(self):
+    @pytest.mark.parametrize("bucket", VALID_BUCKET_NAMES)
+    def test_validate_bucket_name_valid_cases(self, bucket):
         """Test validation of valid bucket names."""
-        assert SecurityValidator.validate_bucket_name("homeassistant") == "homeassistant"
-        assert SecurityValidator.validate_bucket_name("bucket_01") == "bucket_01"
-        assert SecurityValidator.validate_bucket_name("my-bucket") == "my-bucket"
-        assert SecurityValidator.validate_bucket_name("Bucket_Name_123") == "Bucket_Name_123"
+        assert SecurityValidator.validate_bucket_name(bucket) == bucket
 
-    def test_validate_bucket_name_invalid_cases(self):
+    @pytest.mark.parametrize("bucket,match", INVALID_BUCKET_NAMES)
+    def test_validate_bucket_name_invalid_cases(self, bucket, match):
         """Test validation rejects invalid bucket names."""
-        # Empty
-        with pytest.raises(ValueError, match="must be a non-empty string"):
-            SecurityValidator.validate_bucket_name("")
-
-        # Non-string
-        with pytest.raises(ValueError, match="must be a non-empty string"):
-            SecurityValidator.validate_bucket_name(123)
-
-        # Invalid characters
-        with pytest.raises(ValueError, match="Invalid bucket name"):
-            SecurityValidator.validate_bucket_name("bucket.name")
-
-        with pytest.raises(ValueError, match="Invalid bucket name"):
-            SecurityValidator.validate_bucket_name("bucket name")
-
-        # Too long
-        with pytest.raises(ValueError, match="Bucket name too long"):
-            SecurityValidator.validate_bucket_name("a" * 101)
+        with pytest.raises(ValueError, match=match):
+            SecurityValidator.validate_bucket_name(bucket)
 
     def test_validate_time_range_valid_cases(self):
         """Test validation of valid time ranges."""
@@ -136,36 +168,17 @@ class TestSecurityValidator:
         assert start == "2025-01-10T00:00:00Z"
         assert stop == "2025-01-10T23:59:59Z"
 
-    def test_validate_time_range_invalid_cases(self):
-        """Test validation rejects dangerous time ranges."""
-        # Empty values
-        with pytest.raises(ValueError, match="cannot be empty"):
-            SecurityValidator.validate_time_range("", "now()")
-
-        with pytest.raises(ValueError, match="cannot be empty"):
-            SecurityValidator.validate_time_range("-1h", "")
-
-        # Non-string values
-        with pytest.raises(ValueError, match="must be strings"):
-            SecurityValidator.validate_time_range(123, "now()")
-
-        # Dangerous patterns
-        dangerous_inputs = [
-            "import('influxdata/influxdb/v1')",
-            "from(bucket: 'test')",
-            "buckets()",
-            "drop()",
-            "delete()",
-            "org()",
-            "token()",
-            "exec('rm -rf /')",
-            "eval('malicious code')",
-            "system('hack')"
-        ]
-
-        for dangerous_input in dangerous_inputs:
-            with pytest.raises(ValueError, match="Potentially dangerous pattern"):
-                SecurityValidator.validate_time_range(dangerous_input, "now()")
+    @pytest.mark.parametrize("range_start,range_stop,match", INVALID_TIME_RANGES)
+    def test_validate_time_range_invalid_cases(self, range_start, range_stop, match):
+        """Test validation rejects empty and non-string time ranges."""
+        with pytest.raises(ValueError, match=match):
+            SecurityValidator.validate_time_range(range_start, range_stop)
+
+    @pytest.mark.parametrize("malicious", DANGEROUS_TIME_RANGES)
+    def test_validate_time_range_dangerous_patterns(self, malicious):
+        """Test validation rejects time ranges with dangerous patterns."""
+        with pytest.raises(ValueError, match="Potentially dangerous pattern"):
+            SecurityValidator.validate_time_range(malicious, "now()")
 
     def test_validate_query_parameters_valid_cases(self):
         """Test validation of complete parameter sets."""
@@ -212,31 +225,78 @@ class TestSecurityValidator:
         expected = 'r["_measurement"] == "sensor" and r["entity_id"] == "temperature" and r["_field"] == "state"'
         assert filter_expr == expected
 
-    def test_check_for_injection_attempts_safe_cases(self):
-        """Test detection of injection attempts on safe queries."""
-        safe_queries = [
-            'from(bucket: "test") |> range(start: -1h)',
-            'r["_measurement"] == "sensor" and r["entity_id"] == "test"',
-            'from(bucket: "homeassistant") |> filter(fn: (r) => r._value > 0)'
-        ]
+    def test_build_safe_batch_filter(self):
+        """Test building of filter expressions matching several entities."""
+        filter_expr = SecurityValidator.build_safe_batch_filter("sensor", ["humidity", "temperature"])
+
+        expected = ('r["_measurement"] == "sensor"'
+                    ' and (r["entity_id"] == "humidity" or r["entity_id"] == "temperature")'
+                    ' and r["_field"] == "value"')
+        assert filter_expr == expected
+        assert not SecurityValidator.check_for_injection_attempts(filter_expr)
 
-        for query in safe_queries:
-            assert not SecurityValidator.check_for_injection_attempts(query)
+    @pytest.mark.parametrize("query", SAFE_QUERIES)
+    def test_check_for_injection_attempts_safe_cases(self, query):
+        """Test detection of injection attempts on safe queries."""
+        assert not SecurityValidator.check_for_injection_attempts(query)
 
-    def test_check_for_injection_attempts_dangerous_cases(self):
+    @pytest.mark.parametrize("malicious", DANGEROUS_QUERIES)
+    def test_check_for_injection_attempts_dangerous_cases(self, malicious):
         """Test detection of injection attempts on dangerous queries."""
-        dangerous_queries = [
-            'import "influxdata/influxdb/v1"',
-            'from(bucket: "test") |> drop()',
-            'exec("rm -rf /")',
-            'eval("malicious")',
-            'drop table users',
-            'delete from measurements',
-            'union select * from passwords',
-            '<script>alert("xss")</script>',
-            'javascript:alert("xss")',
-            'data:text/html,<script>alert("xss")</script>'
-        ]
-
-        for query in dangerous_queries:
-            assert SecurityValidator.check_for_injection_attempts(query)
\ No newline at end of file
+        assert SecurityValidator.check_for_injection_attempts(malicious)
+
+    def test_dangerous_patterns_case_insensitive(self):
+        """Test keyword detection ignores case."""
+        with pytest.raises(ValueError, match="dangerous pattern detected in time range: exec\\("):
+            SecurityValidator.validate_time_range("EXEC('rm -rf /')", "now()")
+
+        assert SecurityValidator.check_for_injection_attempts('DROP TABLE users')
+        assert SecurityValidator.check_for_injection_attempts('FROM(host: "evil")')
+        assert not SecurityValidator.check_for_injection_attempts('FROM(bucket: "test")')
+
+    def test_validate_entity_id_length_limits(self):
+        """Test entity IDs at the exact length limits are accepted."""
+        domain, entity = SecurityValidator.validate_entity_id(f"{'d' * 50}.{'e' * 100}")
+        assert domain == "d" * 50
+        assert entity == "e" * 100
+
+    def test_validate_query_parameters_cached(self):
+        """Test repeated validation of the same parameters is served from cache."""
+        params = {
+            'entity_id': 'sensor.cached',
+            'bucket': 'homeassistant',
+            'range_start': '-1h',
+            'range_stop': 'now()'
+        }
+
+        first = SecurityValidator.validate_query_parameters(params)
+        hits = SecurityValidator._validate_core_parameters.cache_info().hits
+        second = SecurityValidator.validate_query_parameters(params)
+
+        assert first == second
+        assert SecurityValidator._validate_core_parameters.cache_info().hits == hits + 1
+
+    def test_validate_query_parameters_bucket_checked_before_time_range(self):
+        """Test an invalid bucket is reported before an invalid time range."""
+        params = {'entity_id': 'sensor.temperature', 'bucket': 'bad bucket',
+                  'range_start': 'drop()', 'range_stop': 'now()'}
+
+        with pytest.raises(ValueError, match="Invalid bucket name: 'bad bucket'"):
+            SecurityValidator.validate_query_parameters(params)
+
+    def test_validate_query_parameters_partial(self):
+        """Test parameter sets without every query parameter are still validated."""
+        validated = SecurityValidator.validate_query_parameters({'entity_id': 'sensor.temperature'})
+        assert validated == {'domain': 'sensor', 'entity': 'temperature'}
+
+        with pytest.raises(ValueError, match="must be a non-empty string"):
+            SecurityValidator.validate_query_parameters({'entity_id': 'sensor.temperature', 'bucket': 123,
+                                                         'range_start': '-1h', 'range_stop': 'now()'})
+
+    def test_validate_time_range_rejects_injection_keywords(self):
+        """Test time ranges are checked against the query injection keywords as well."""
+        with pytest.raises(ValueError, match="Potentially dangerous pattern"):
+            SecurityValidator.validate_time_range("2025-01-10T00:00:00Z'; DROP TABLE measurements; --", "now()")
+
+        with pytest.raises(ValueError, match="Potentially dangerous pattern"):
+            SecurityValidator.validate_time_range("-1h", "now() union select")